@@ -1,13 +1,11 @@
-import re
+import copy
 import shutil
 import uuid
-import json
 import time
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-import wget
 from moviepy.editor import AudioFileClip
-from moviepy.video.VideoClip import ImageClip
 from PIL import Image
 import zipfile
 import os
@@ -18,10 +16,35 @@ from datetime import datetime
 from modules.utils import cdn_to_s3, s3_to_cdn, upload_s3
 
 from modules.script_to_draft_v2_keyframe import insert_keyframe
+from modules.script_to_draft_v2_ids import id_allocator
+from modules.script_to_draft_v2_model import Track, text_content
+from modules.script_to_draft_v2_assembly import caption_id_count, render_caption
+from modules.script_to_draft_v2_probe import probe_mp3_duration, record_probe_fallback, get_probe_stats, \
+    probe_image_size, record_image_fallback
+from modules import script_to_draft_v2_json
+from modules.script_to_draft_v2_writer import StreamingJsonWriter
+from modules.script_to_draft_v2_template import compile_material_templates
+from modules.script_to_draft_v2_download import AsyncDownloader, DownloadReport, MaterialDownloadError
+from modules.script_to_draft_v2_placeholder import ensure_placeholders
+from modules.script_to_draft_v2_cache import MaterialCache, ProbeCache, probe_cache_key
+from modules.script_to_draft_v2_zip import MultipartUploadStream, ZipStats, write_zip_entry, write_zip_data, \
+    zip_text_entry, DEFAULT_COMPRESS_LEVEL
+from modules.script_to_draft_v2_metrics import DraftMetrics
+from modules.script_to_draft_v2_subtitle import split_captions
+from modules.script_to_draft_v2_incremental import MANIFEST_NAME, caption_manifest, open_previous_draft, \
+    manifest_document, same_material, shift_segments, write_manifest
 
 
 DRAFT_FOLDER = "./data/cut_draft/"
 TEMP_FOLDER = "./temp/"
+README_NAME = "请将旁边的文件夹，复制到剪映草稿文件夹中.txt"
+# 素材缓存目录，多次生成同一章节时不再重复下载
+CACHE_FOLDER = "./cache/materials/"
+CACHE_MAX_BYTES = 10 * 1024 ** 3
+# 素材解析结果(音频时长、图片宽高)缓存
+PROBE_CACHE_FILE = "./cache/probe.sqlite3"
+# 流水线模式下解析素材时长/分辨率的线程数
+PROBE_WORKERS = 4
 
 
 def get_duration(filename):
@@ -31,11 +54,87 @@ def get_duration(filename):
     return delta_duration_time
 
 
+def get_duration_us(filename):
+    # 优先解析mp3帧头获取时长，解析失败才启动MoviePy
+    duration = probe_mp3_duration(filename)
+    if duration is None:
+        record_probe_fallback()
+        duration = get_duration(filename)
+    # 单位是微秒，加33333是为了防止精度丢失
+    return int(duration * 10 ** 6 + 33333)
+
+
 def get_image_size(image_path):
+    # 优先只读文件头，JPEG/PNG/WebP以外的格式再用PIL打开
+    size = probe_image_size(image_path)
+    if size is not None:
+        return size
+    record_image_fallback()
     with Image.open(image_path) as img:
         return img.size
 
 
+_default_downloader = None
+_default_probe_cache = None
+_draft_templates = {}
+
+
+def load_draft_templates(folder=None):
+    # 模板json每个进程只解析一次，每个草稿拿到一份深拷贝
+    folder = folder or DRAFT_FOLDER
+    if folder not in _draft_templates:
+        with open(os.path.join(folder, 'draft_content.json'), 'r', encoding='utf-8') as f:
+            draft_content = script_to_draft_v2_json.load(f)
+        with open(os.path.join(folder, 'draft_meta_info.json'), 'r', encoding='utf-8') as f:
+            draft_meta_info = script_to_draft_v2_json.load(f)
+        _draft_templates[folder] = (draft_content, draft_meta_info)
+    draft_content, draft_meta_info = _draft_templates[folder]
+    return copy.deepcopy(draft_content), copy.deepcopy(draft_meta_info)
+
+
+# 草稿json由CutDraft生成，不从模板目录复制
+GENERATED_DRAFT_FILES = ('draft_content.json', 'draft_meta_info.json')
+_draft_files = {}
+
+
+def load_draft_files(folder=None):
+    # 虚拟组装用: 模板目录中其余的静态文件每个进程只读一次
+    # 返回 (子目录列表, 文件列表)，文件为 (相对路径, 内容, 修改时间, 权限)
+    folder = folder or DRAFT_FOLDER
+    if folder not in _draft_files:
+        dirs = []
+        files = []
+        for folder_name, dir_names, file_names in os.walk(folder):
+            relative_folder_path = os.path.relpath(folder_name, folder)
+            dir_names.sort()
+            for dir_name in dir_names:
+                dirs.append(os.path.normpath(os.path.join(relative_folder_path, dir_name)))
+            for file_name in sorted(file_names):
+                relative_file_path = os.path.normpath(os.path.join(relative_folder_path, file_name))
+                if relative_file_path in GENERATED_DRAFT_FILES:
+                    continue
+                file_path = os.path.join(folder_name, file_name)
+                st = os.stat(file_path)
+                with open(file_path, 'rb') as f:
+                    files.append((relative_file_path, f.read(), time.localtime(st.st_mtime)[:6], st.st_mode & 0o777))
+        _draft_files[folder] = (dirs, files)
+    return _draft_files[folder]
+
+
+def get_default_downloader():
+    global _default_downloader
+    if _default_downloader is None:
+        _default_downloader = AsyncDownloader(cache=MaterialCache(CACHE_FOLDER, CACHE_MAX_BYTES))
+    return _default_downloader
+
+
+def get_default_probe_cache():
+    global _default_probe_cache
+    if _default_probe_cache is None:
+        _default_probe_cache = ProbeCache(PROBE_CACHE_FILE)
+    return _default_probe_cache
+
+
 class CutDraft:
     def __init__(self, chapter_id, draft_name: str, user_path: str, caps, enable_key_frame, *args, **kwargs):
         logging.info("合成草稿, 后端发来的参数 = chapter_id: %s, draft_name: %s, user_path: %s, caps: %s, enable_key_frame: %s" % (chapter_id, draft_name, user_path, caps, enable_key_frame))
@@ -51,6 +150,9 @@ class CutDraft:
 
         self.draft_uuid = str(uuid.uuid4()).upper()
         self.content_id = str(uuid.uuid4()).upper()
+        # 素材和片段id批量生成；id_seed固定时草稿内的id可复现(临时目录名仍然随机)
+        self.id_seed = kwargs.get('id_seed')
+        self.ids = id_allocator(self.id_seed)
         self.create_time_stamp = int(time.time() * 1000)
 
         self.local_path = os.path.join(TEMP_FOLDER, self.draft_uuid)
@@ -59,16 +161,70 @@ class CutDraft:
         self.user_path = self.user_raw_path
         self.user_draft_path = os.path.join(self.user_path, draft_name)
         self.user_material_path = os.path.join(self.user_draft_path, "material")
+        # 草稿json增量写入时的临时目录，_save_draft之后删除
+        self.local_spool_path = os.path.join(self.local_path, ".spool")
+        # 下载和素材解析是否流水线并行
+        self.pipeline = kwargs.get('pipeline', True)
+        self.caption_meta = None
+        # uploader_factory(zip文件名)返回分片上传器时，zip边压缩边上传，不写本地文件
+        self.uploader_factory = kwargs.get('uploader_factory')
+        # json等文件的deflate压缩级别(0-9)
+        self.zip_compress_level = kwargs.get('zip_compress_level', DEFAULT_COMPRESS_LEVEL)
+        # 草稿json去掉分隔符后的空格，可以用orjson直接编码；默认与json.dump的格式一致
+        self.compact_json = kwargs.get('compact_json', False)
+        # 虚拟组装: 模板文件和生成的json直接写入zip，临时目录里只有下载的素材
+        # 随机关键帧还需要读写磁盘上的draft_content.json，开启时退回普通模式
+        self.virtual_draft = kwargs.get('virtual_draft', False) and enable_key_frame != 1
+        self.zip_stats = None
+        # 每个任务的分阶段指标，默认不写文件；传入metrics_path时追加一条json记录，Prometheus文本写入metrics_prom_path
+        # metrics_download_items为True时记录里带上每个下载文件的明细
+        self.metrics = DraftMetrics(chapter_id, self.draft_name, kwargs.get('metrics_download_items', False))
+        self.metrics_path = kwargs.get('metrics_path')
+        self.metrics_prom_path = kwargs.get('metrics_prom_path')
+        # 可以传入共享的下载器，多个草稿复用同一个连接池
+        self.downloader = kwargs.get('downloader') or get_default_downloader()
+        # 本任务的下载重试策略(RetryPolicy)，None时用下载器的默认策略
+        self.retry_policy = kwargs.get('retry_policy')
+        # 素材下载彻底失败时: 'fail'立即取消其余下载并结束任务，'placeholder'换成占位素材继续生成
+        self.missing_material = kwargs.get('missing_material', 'fail')
+        self.placeholder_image = kwargs.get('placeholder_image')
+        self.placeholder_audio = kwargs.get('placeholder_audio')
+        self.placeholders = None
+        self.download_report = None
+        self.download_aborted = False
+        # 素材解析结果缓存，传False不使用
+        probe_cache = kwargs.get('probe_cache')
+        self.probe_cache = get_default_probe_cache() if probe_cache is None else (probe_cache or None)
+        if self.probe_cache is not None:
+            # 本任务的解析缓存命中数，缓存对象上的计数是整个进程累计的
+            self.metrics.set("probe_cache_hits", 0)
+            self.metrics.set("probe_cache_misses", 0)
+        self.download_futures = []
+        # 上一版草稿zip的本地路径，传入时只重新下载、解析有变化的素材，没变化的字幕直接复用
+        self.previous_draft_path = kwargs.get('previous_draft')
+        self.previous = None
+        self.reused_meta = None
+        self.previous_etags = None
+        self.reused_files = []
+        self.manifest_captions = []
+        self.manifest_offsets = {}
+
+    def _generation_options(self):
+        # 写入清单: 这些参数改变时复用的片段和新生成的不一致，需要全量生成
+        return {"enable_key_frame": self.enable_key_frame}
 
     def prepare_local_folder(self):
         if not os.path.exists(self.local_draft_path):
             os.makedirs(self.local_draft_path)
         if not os.path.exists(self.local_material_path):
             os.makedirs(self.local_material_path)
-        with open(os.path.join(self.local_path, "请将旁边的文件夹，复制到剪映草稿文件夹中.txt"), "w",
-                  encoding='utf-8') as f:
-            f.write(
-                "请将旁边的文件夹（以片段命名的文件夹），复制到剪映草稿文件夹中，请勿修改内部任何结构，你的剪映草稿地址是：\n%s" % self.user_raw_path)
+        if self.virtual_draft:
+            return
+        with open(os.path.join(self.local_path, README_NAME), "w", encoding='utf-8') as f:
+            f.write(self._readme_text())
+
+    def _readme_text(self):
+        return "请将旁边的文件夹（以片段命名的文件夹），复制到剪映草稿文件夹中，请勿修改内部任何结构，你的剪映草稿地址是：\n%s" % self.user_raw_path
 
     def speeds_creator(self, speed_uuid):
         tmp_data = {
@@ -453,6 +609,9 @@ class CutDraft:
         }
         return tmp_data
 
+    def text_content(self, content):
+        return text_content(content)
+
     def text_creator(self, content, text_uuid):
         tmp_data = {
             "add_type": 0,
@@ -474,7 +633,7 @@ class CutDraft:
 
                 ]
             },
-            "content": "{\"text\":\"%s\",\"styles\":[{\"strokes\":[{\"content\":{\"solid\":{\"color\":[0,0,0]}},\"width\":0.08}],\"size\":7,\"fill\":{\"content\":{\"solid\":{\"color\":[1,0.870588,0]}}},\"range\":[0,%d]}]}" % (content, len(content)),
+            "content": self.text_content(content),
             "fixed_height": -1,
             "fixed_width": 600,
             "font_category_id": "",
@@ -561,8 +720,8 @@ class CutDraft:
         if not os.path.exists(self.local_draft_path):
             os.makedirs(self.local_draft_path)
 
-        # 复制所有模板json
-        for item in os.listdir(DRAFT_FOLDER):
+        # 复制所有模板json，虚拟组装时在压缩阶段直接从模板写入zip
+        for item in ([] if self.virtual_draft else os.listdir(DRAFT_FOLDER)):
             s = os.path.join(DRAFT_FOLDER, item)
             d = os.path.join(self.local_draft_path, item)
             if os.path.isdir(s):
@@ -570,34 +729,14 @@ class CutDraft:
             else:
                 shutil.copy2(s, d)
 
-        with open(os.path.join(self.local_draft_path, 'draft_content.json'), 'r', encoding='utf-8') as f:
-            self.draft_content = json.load(f)
-        with open(os.path.join(self.local_draft_path, 'draft_meta_info.json'), 'r', encoding='utf-8') as f:
-            self.draft_meta_info = json.load(f)
+        self.draft_content, self.draft_meta_info = load_draft_templates()
+        if self.previous_draft_path:
+            self.previous = open_previous_draft(self.previous_draft_path, self._generation_options())
 
-        self.width = 1280
-        self.height = 960
-        try:
-            # 读取caps第一个元素的图片地址，获取分辨率，设置为width、height
-            imageItem0Url = self.caps[0]['image_url']
-            imageItem0TempPath = os.path.join(self.local_draft_path, "imageItem0Temp.jpg")
-            wget.download(cdn_to_s3(imageItem0Url), imageItem0TempPath, bar=None)
-            imageItem0Temp = ImageClip(imageItem0TempPath)
-            self.width = imageItem0Temp.w
-            self.height = imageItem0Temp.h
-            logging.info(f"剪映草稿分辨率: {self.width} x {self.height}")
-            # 删除临时文件
-            os.remove(imageItem0TempPath)
-            logging.info(f"删除临时文件: {imageItem0TempPath}")
-        except:
-            import traceback
-            logging.error(f"获取分辨率失败: {traceback.format_exc()}")
-            self.width = 1280
-            self.height = 960
+        # 分辨率在_add_tracks中用第一张已下载图片的文件头设置，这里先用默认值
+        self._set_canvas_size(1280, 960)
 
-        self.draft_content['id'] = str(uuid.uuid4()).upper()
-        self.draft_content['canvas_config']['height'] = self.height
-        self.draft_content['canvas_config']['width'] = self.width
+        self.draft_content['id'] = self.ids.new()
         self.draft_content['materials']['audios'] = []
         self.draft_content['materials']['beats'] = []
         self.draft_content['materials']['canvases'] = []
@@ -606,7 +745,7 @@ class CutDraft:
         self.draft_content['materials']['speeds'] = []
         self.draft_content['tracks'] = []
 
-        self.draft_meta_info['draft_id'] = str(uuid.uuid4()).upper()
+        self.draft_meta_info['draft_id'] = self.ids.new()
         self.draft_meta_info['draft_fold_path'] = self.user_draft_path
         self.draft_meta_info['draft_root_path'] = self.user_path
         self.draft_meta_info['draft_name'] = self.draft_name
@@ -620,254 +759,483 @@ class CutDraft:
             self.draft_content['last_modified_platform']['os'] = 'mac'
             self.draft_content['last_modified_platform']['os_version'] = '12.3.1'
 
-    def _download_with_retry(self, url, path, max_retries=3):
-        retries = 0
-        url = cdn_to_s3(url)
-        while retries < max_retries:
-            try:
-                wget.download(url, path, bar=None)
-                return True  # 返回 True 表示下载成功
-            except Exception as e:
-                print(f"下载失败，正在重试... ({retries + 1}/{max_retries})")
-                retries += 1
-                time.sleep(1)
-        print(f"下载失败，已达到最大重试次数：{url}")
-        return False  # 返回 False 表示下载失败
-
-    def _download_single_material(self, cap, index):
-        # 下载单个素材的函数
-        image_path = os.path.join(self.local_material_path, '%d.jpg' % index)
-        audio_path = os.path.join(self.local_material_path, '%d.mp3' % index)
-
-        # 下载图片，带重试
-        image_result = self._download_with_retry(cap['image_url'], image_path)
-        # 下载音频，带重试
-        audio_result = self._download_with_retry(cap['audio_url'], audio_path)
-
-        # 返回一个元组，包含索引和两个下载结果
-        return (index, image_result, audio_result)
+    def _set_canvas_size(self, width, height):
+        self.width = width
+        self.height = height
+        self.draft_content['canvas_config']['height'] = self.height
+        self.draft_content['canvas_config']['width'] = self.width
 
     def _download_mats(self):
         # 计算下载耗时
         start_time = time.time()
 
-        # 使用线程池执行下载
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            # 创建一个future列表
-            futures = [executor.submit(self._download_single_material, cap, i) for i, cap in enumerate(self.caps)]
-            # 收集结果
-            results = [future.result() for future in futures]  # 这里会等待每个线程完成，并收集结果
+        # 占位素材在提交下载之前准备好，流水线里下载失败的字幕可能马上开始解析
+        if self.missing_material == 'placeholder':
+            self.placeholders = ensure_placeholders(os.path.join(TEMP_FOLDER, ".placeholder"),
+                                                    self.placeholder_image, self.placeholder_audio)
 
-        end_time = time.time()
-        print("下载素材耗时: %s" % (end_time - start_time))
-
-        # 处理结果
-        for result in results:
-            index, image_result, audio_result = result
-            if not image_result or not audio_result:
-                print(f"下载失败的素材索引: {index}")
-
-    def _add_tracks(self):
-
-        start_time = 0
-        total_time = 0
-        n = 0
+        # 所有图片和音频交给异步下载器，按host复用连接
+        futures = self.download_futures = []
+        if self.previous is not None:
+            self.reused_meta = [self.previous.reusable_meta(i, cap) for i, cap in enumerate(self.caps)]
+            self.previous_etags = [self.previous.material_etags(i, cap) for i, cap in enumerate(self.caps)]
+        for i, cap in enumerate(self.caps):
+            image_etag, audio_etag = self.previous_etags[i] if self.previous_etags else (None, None)
+            futures.append(self._submit_download(cap['image_url'], '%d.jpg' % i, image_etag))
+            futures.append(self._submit_download(cap['audio_url'], '%d.mp3' % i, audio_etag))
 
-        # 创建多媒体track
-        track_audio_uuid = str(uuid.uuid4()).upper()
-        track_video_uuid = str(uuid.uuid4()).upper()
-        track_text_uuid = str(uuid.uuid4()).upper()
+        # 流水线模式: 每个字幕的图片和音频都下载完后立即开始解析时长和分辨率
+        self.caption_meta = None
+        if self.pipeline:
+            self.probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+            self.caption_meta = [Future() for _ in self.caps]
+            for i in range(len(self.caps)):
+                self._probe_when_downloaded(i, futures[i * 2], futures[i * 2 + 1])
 
-        tmp_video_track = dict(attribute=0, flag=0, id=track_video_uuid, segments=[], type="video")
-        tmp_audio_track = dict(attribute=0, flag=0, id=track_audio_uuid, segments=[], type="audio")
-        tmp_text_track = dict(attribute=0, flag=0, id=track_text_uuid, segments=[], type="text")
+        report = self.download_report = self._collect_downloads(futures)
 
-        for i, cap in enumerate(self.caps):
-
-            image_name = "%d.jpg" % i
-            audio_name = "%d.mp3" % i
+        end_time = time.time()
+        report.seconds = end_time - start_time
+        print("下载素材耗时: %s" % (end_time - start_time))
 
-            local_image_path = os.path.join(self.local_material_path, image_name)
-            local_audio_path = os.path.join(self.local_material_path, audio_name)
+        # 处理结果，被取消的下载没有结果
+        results = [result for result in report.results if result is not None]
+        for result in results:
+            self.metrics.record_download(result.url, result.path, result.ok, result.bytes, result.latency,
+                                         attempts=result.attempts, cache_hit=result.cache_hit)
+        for index in sorted({i // 2 for i, _ in report.failed}):
+            print(f"下载失败的素材索引: {index}")
+        self.metrics.set("download_failed", len(report.failed))
+        self.metrics.set("download_cancelled", report.cancelled)
+        self.metrics.set("download_placeholders", len(report.placeholders))
+        # 本任务各请求发起时的并发上限(下载器按吞吐和延迟自动调整)
+        levels = [result.concurrency for result in results if result.concurrency]
+        if levels:
+            logging.info("下载并发数: 平均 %.1f, 最小 %d, 最大 %d, 下载器状态 %s" % (
+                sum(levels) / len(levels), min(levels), max(levels), self.downloader.concurrency_stats()))
+            self.metrics.set("download_concurrency_avg", round(sum(levels) / len(levels), 2))
+            self.metrics.set("download_concurrency_max", max(levels))
+        if not report.ok:
+            if self.caption_meta is not None:
+                self.probe_executor.shutdown(wait=True, cancel_futures=True)
+            logging.error("素材下载失败，已取消其余 %d 个下载: %s" % (report.cancelled, report.as_dict()))
+            raise MaterialDownloadError(report)
+        logging.info("下载素材 %d 个, 共 %d bytes" % (len(results), sum(result.bytes for result in results)))
+        if self.previous is not None:
+            # 服务端确认没有变化、本地也没有副本(304且不在缓存中)的素材，zip时从上一版草稿中原样复制
+            for i, etags in enumerate(self.previous_etags):
+                for k, (file_name, etag) in enumerate((('%d.jpg' % i, etags[0]), ('%d.mp3' % i, etags[1]))):
+                    if same_material(report.results[i * 2 + k], etag) and \
+                            not os.path.exists(os.path.join(self.local_material_path, file_name)):
+                        self.reused_files.append(file_name)
+            logging.info("复用上一版素材 %d 个" % len(self.reused_files))
+            self.metrics.set("reused_files", len(self.reused_files))
+        if self.downloader.cache is not None:
+            # 按本任务的下载结果统计，缓存对象上的计数是整个进程累计的
+            hits = [result for result in results if result.cache_hit]
+            misses = [result for result in results if result.ok and not result.cache_hit and result.status != 304]
+            cache_stats = {"hits": len(hits), "misses": len(misses),
+                           "bytes_saved": sum(result.bytes_saved for result in hits)}
+            logging.info("素材缓存统计: %s" % cache_stats)
+            self.metrics.set("cache_hits", cache_stats["hits"])
+            self.metrics.set("cache_misses", cache_stats["misses"])
+            self.metrics.set("cache_bytes_saved", cache_stats["bytes_saved"])
+
+    def _collect_downloads(self, futures):
+        # 按完成顺序处理下载结果，某个素材重试后仍然失败时立即取消其余下载，不再等所有任务结束
+        report = DownloadReport(len(futures))
+        indexes = {future: i for i, future in enumerate(futures)}
+        for future in as_completed(futures):
+            i = indexes[future]
+            result = future.result()
+            report.results[i] = result
+            if result is None or result.ok:
+                continue
+            report.failed.append((i, result))
+            if self.missing_material == 'placeholder':
+                report.placeholders.append(i)
+                continue
+            self.download_aborted = True
+            report.cancelled = sum(1 for other in futures if other.cancel())
+            break
+        return report
+
+    def _use_placeholders(self, results, local_image_path, local_audio_path):
+        # 下载失败的素材换成占位素材，results是这条字幕 (图片, 音频) 的下载结果
+        if self.placeholders is None:
+            return
+        for result, path, kind in ((results[0], local_image_path, "image"), (results[1], local_audio_path, "audio")):
+            if result is not None and not result.ok:
+                shutil.copyfile(self.placeholders[kind], path)
+
+    def _submit_download(self, url, file_name, etag=None):
+        # etag是上一版草稿里同一地址素材的ETag，带上它做条件请求，没有变化时服务端返回304、不下载
+        return self.downloader.submit(cdn_to_s3(url), os.path.join(self.local_material_path, file_name),
+                                      self.retry_policy, etag)
+
+    def _reusable_meta(self, index, results):
+        # 上一版的解析结果，素材经条件请求确认没有变化才能用；results是这条字幕 (图片, 音频) 的下载结果
+        if not self.reused_meta:
+            return None, None
+        audio_meta, image_meta = self.reused_meta[index]
+        image_etag, audio_etag = self.previous_etags[index]
+        return (audio_meta if same_material(results[1], audio_etag) else None,
+                image_meta if same_material(results[0], image_etag) else None)
+
+    def _material_etags(self, index):
+        # 写入清单的 (图片ETag, 音频ETag)
+        results = [future.result() for future in self.download_futures[index * 2:index * 2 + 2]]
+        if len(results) != 2:
+            return None, None
+        return tuple(result.etag if result is not None and result.ok else None for result in results)
+
+    def _probe_when_downloaded(self, index, image_future, audio_future):
+        pending = [2]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                pending[0] -= 1
+                ready = pending[0] == 0
+            if not ready:
+                return
+            if self.download_aborted:
+                # 下载阶段已经失败，不再解析
+                self.caption_meta[index].cancel()
+                return
+            try:
+                self.probe_executor.submit(self._probe_into, index, self.caption_meta[index],
+                                           (image_future, audio_future))
+            except RuntimeError:
+                self.caption_meta[index].cancel()
 
-            user_image_path = os.path.join("./material", image_name)
-            user_audio_path = os.path.join("./material", audio_name)  # TODO: 这里这里！
+        image_future.add_done_callback(on_done)
+        audio_future.add_done_callback(on_done)
 
-            # 这一步处理音频信息
+    def _probe_into(self, index, future, downloads):
+        try:
+            future.set_result(self._probe_caption(index, downloads))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _probe_caption(self, index, downloads=None):
+        # 解析单个字幕的素材信息: (音频时长, 音频创建时间, 图片宽, 图片高, 图片创建时间)
+        # downloads是这条字幕 (图片, 音频) 的下载future，默认从download_futures中取
+        local_image_path = os.path.join(self.local_material_path, "%d.jpg" % index)
+        local_audio_path = os.path.join(self.local_material_path, "%d.mp3" % index)
+        probe_start = time.perf_counter()
+        if downloads is None:
+            downloads = self.download_futures[index * 2:index * 2 + 2]
+        results = [future.result() for future in downloads] if len(downloads) == 2 else [None, None]
+        self._use_placeholders(results, local_image_path, local_audio_path)
+        # 增量生成时没有变化的素材直接用上一版的解析结果
+        audio_meta, image_meta = self._reusable_meta(index, results)
+
+        # 这一步处理音频信息
+        if audio_meta is not None:
+            delta_duration, mp3file_create_time = audio_meta
+        else:
             stat = os.stat(local_audio_path)
             mp3file_create_time = stat.st_ctime
 
             try:
-                # 获取音频时长，单位是微秒，加5000是为了防止精度丢失
-                delta_duration = int(get_duration(local_audio_path) * 10 ** 6 + 33333)
+                # 获取音频时长，单位是微秒
+                delta_duration = self._probe_file("audio", local_audio_path, results[1], get_duration_us)
             except:
                 delta_duration = 0
 
-            # 处理draft_content文件
-            audio_uuid = str(uuid.uuid4()).upper()
-            sound_channel_mapping_uuid = str(uuid.uuid4()).upper()
-            speed_uuid = str(uuid.uuid4()).upper()
-            beats_uuid = str(uuid.uuid4()).upper()
-            audio_segment_uuid = str(uuid.uuid4()).upper()
-
-            # 创建与meta文件关联ID并将其写入meta
-            music_id = str(uuid.uuid4())
-            tmp_music = self.meta_music_creator(music_id, duration=delta_duration, filepath=user_audio_path,
-                                                filename=audio_name, create_time=mp3file_create_time)
-
-            self.draft_meta_info['draft_materials'][0]['value'].append(tmp_music)
-
-            tmp_sound_channel_mapping = self.sound_channel_mappings_creator(sound_channel_mapping_uuid)
-            tmp_speed = self.speeds_creator(speed_uuid)
-            tmp_beat = self.beats_creator(beats_uuid)
-            tmp_audio = self.audio_creator(delta_duration, audio_name, audio_uuid, music_id)
-
-            self.draft_content['materials']['sound_channel_mappings'].append(tmp_sound_channel_mapping)
-            self.draft_content['materials']['speeds'].append(tmp_speed)
-            self.draft_content['materials']['beats'].append(tmp_beat)
-            self.draft_content['materials']['audios'].append(tmp_audio)
-
-            tmp_audio_segment = self.audio_segment_creator(
-                material_uuid_list=[sound_channel_mapping_uuid, speed_uuid, beats_uuid],
-                duration=delta_duration, start_time=start_time,
-                audio_uuid=audio_uuid, audio_segment_uuid=audio_segment_uuid)
-
-            # 这一步处理图片信息
-            canvas_uuid = str(uuid.uuid4()).upper()
-            material_animation_uuid = str(uuid.uuid4()).upper()
-            tmp_canvas = self.canvases_creator(canvas_uuid)
-            tmp_animation = self.animation_creator(material_animation_uuid)
-            tmp_video_uuid = str(uuid.uuid4()).upper()
-
-            # 获取图片信息
-            width, height = get_image_size(local_image_path)
+        # 获取图片信息
+        if image_meta is not None:
+            width, height, imgfile_create_time = image_meta
+        else:
+            width, height = self._probe_file("image", local_image_path, results[0], get_image_size)
             stat = os.stat(local_image_path)
             imgfile_create_time = stat.st_ctime
+        self.metrics.record_probe(index, time.perf_counter() - probe_start)
+        return delta_duration, mp3file_create_time, width, height, imgfile_create_time
+
+    def _probe_file(self, kind, path, result, probe):
+        # 同一个素材(地址+ETag+大小，或地址+大小+修改时间)解析过就直接用缓存的结果
+        if kind == "image":
+            # 文件头解析只读几十字节，比查缓存还快，只有要用PIL打开的图片才走缓存
+            size = probe_image_size(path)
+            if size is not None:
+                return size
+        if self.probe_cache is None:
+            return probe(path)
+        key = probe_cache_key(path, result.url if result else None, result.etag if result else None)
+        value = self.probe_cache.get(kind, key)
+        if value is None:
+            self.metrics.add("probe_cache_misses")
+            value = probe(path)
+            self.probe_cache.put(kind, key, value)
+        else:
+            self.metrics.add("probe_cache_hits")
+        return value
+
+    def _add_tracks(self):
+        try:
+            self._assemble_tracks()
+        finally:
+            if self.caption_meta is not None:
+                self.probe_executor.shutdown(wait=True, cancel_futures=True)
+
+    def _assemble_tracks(self):
+
+        start_time = 0
+        total_time = 0
+        n = 0
+
+        # 创建多媒体track
+        track_audio_uuid, track_video_uuid, track_text_uuid = self.ids.take(3)
 
-            meta_video = self.meta_video_creator(create_time=imgfile_create_time, video_uuid=tmp_video_uuid,
-                                                 duration=delta_duration, filename=image_name,
-                                                 filepath=user_image_path, height=height, width=width)
-
-            self.draft_meta_info['draft_materials'][0]['value'].append(meta_video)
-
-            tmp_video = self.video_creator(duration=delta_duration, file_name=image_name, video_uuid=tmp_video_uuid,
-                                           height=int(height), width=int(width))
-
-            self.draft_content['materials']['material_animations'].append(tmp_animation)
-            self.draft_content['materials']['canvases'].append(tmp_canvas)
-            self.draft_content['materials']['videos'].append(tmp_video)
-
-            # 关键帧UUID
-            video_segment_uuid = str(uuid.uuid4()).upper()
-            tmp_video_segment = self.video_segement_creator([canvas_uuid, speed_uuid, material_animation_uuid],
-                                                            duration=delta_duration, start_time=start_time,
-                                                            video_uuid=tmp_video_uuid,
-                                                            video_segment_uuid=video_segment_uuid)
-
-            tmp_animation = self.animation_creator(material_animation_uuid)
-            self.draft_content['materials']['material_animations'].append(tmp_animation)
-            
-            # 这一步是处理字幕
-            content = cap['content_split']
-
-            # 切割字幕为多个小字幕
-            sentences = re.split('。|,|，|！|\!|\.|？|\?|“|：|”', content)
-            while '' in sentences: sentences.remove('')
-            text_start_time = start_time
-            for sentence in sentences:
-                # text_start_time是当前小字幕的开始时间
-                # 当前小字幕的时长
-                text_duration = delta_duration * len(sentence) / len(''.join(sentences))
-                # sentence为当前小字幕
-                text_uuid = str(uuid.uuid4()).upper()
-                tmp_text = self.text_creator(sentence, text_uuid)
-                self.draft_content['materials']['texts'].append(tmp_text)
-                # 添加到text的track中
-                text_segment_uuid = str(uuid.uuid4()).upper()
-                tmp_text_segment = self.text_segment_creator([tmp_animation],
-                                                            duration=text_duration, start_time=text_start_time,
-                                                            text_uuid=text_uuid, text_segment_uuid=text_segment_uuid)
-                # text
-                tmp_text_track['segments'].append(tmp_text_segment)
-                # 更新时间
-                text_start_time += text_duration
-
-            # video
-            tmp_video_track['segments'].append(tmp_video_segment)
-            # audio
-            tmp_audio_track['segments'].append(tmp_audio_segment)
+        tmp_video_track = Track(track_video_uuid, "video").to_dict()
+        tmp_audio_track = Track(track_audio_uuid, "audio").to_dict()
+        tmp_text_track = Track(track_text_uuid, "text").to_dict()
+        self.draft_content['tracks'].append(tmp_video_track)
+        self.draft_content['tracks'].append(tmp_audio_track)
+        self.draft_content['tracks'].append(tmp_text_track)
+
+        # 素材和片段边生成边写入临时文件，内存中只保留当前字幕的数据
+        self.content_writer = StreamingJsonWriter(self.draft_content, self.local_spool_path, self.compact_json)
+        self.meta_writer = StreamingJsonWriter(self.draft_meta_info, self.local_spool_path, self.compact_json)
+        materials = self.draft_content['materials']
+        meta_materials = self.meta_writer.stream(self.draft_meta_info['draft_materials'][0], 'value')
+        sound_channel_mappings = self.content_writer.stream(materials, 'sound_channel_mappings')
+        speeds = self.content_writer.stream(materials, 'speeds')
+        beats = self.content_writer.stream(materials, 'beats')
+        audios = self.content_writer.stream(materials, 'audios')
+        material_animations = self.content_writer.stream(materials, 'material_animations')
+        canvases = self.content_writer.stream(materials, 'canvases')
+        videos = self.content_writer.stream(materials, 'videos')
+        texts = self.content_writer.stream(materials, 'texts')
+        video_segments = self.content_writer.stream(tmp_video_track, 'segments')
+        audio_segments = self.content_writer.stream(tmp_audio_track, 'segments')
+        text_segments = self.content_writer.stream(tmp_text_track, 'segments')
+        templates = compile_material_templates(self, self.compact_json)
+        streams = dict(meta_materials=meta_materials, sound_channel_mappings=sound_channel_mappings, speeds=speeds,
+                       beats=beats, audios=audios, material_animations=material_animations, canvases=canvases,
+                       videos=videos, texts=texts, video_segments=video_segments, audio_segments=audio_segments,
+                       text_segments=text_segments)
+        # 模板自带的元素个数，增量生成时用来定位每条字幕的数据
+        self.manifest_offsets = {name: len(array) for name, array in streams.items()}
+        self.manifest_captions = []
+        reused_captions = 0
+        # 所有字幕一次切分好
+        caption_sentences = split_captions(cap['content_split'] for cap in self.caps)
+
+        for i, cap in enumerate(self.caps):
+
+            # 按字幕顺序取素材信息，流水线模式下等待对应的解析任务完成
+            if self.caption_meta is not None:
+                caption_meta = self.caption_meta[i].result()
+            else:
+                caption_meta = self._probe_caption(i)
+            delta_duration, mp3file_create_time, width, height, imgfile_create_time = caption_meta
+
+            if i == 0:
+                # 第一张图片的分辨率作为草稿分辨率
+                self._set_canvas_size(width, height)
+                logging.info(f"剪映草稿分辨率: {self.width} x {self.height}")
+
+            etags = self._material_etags(i)
+            previous_etags = self.previous_etags[i] if self.previous_etags else (None, None)
+            if self.previous is not None and self.previous.unchanged(i, cap) and etags == previous_etags and \
+                    None not in etags:
+                # 字幕和素材都没有变化: 复用上一版的素材和片段，只平移开始时间
+                self._reuse_caption(i, streams, start_time)
+                self.manifest_captions.append(
+                    caption_manifest(cap, caption_meta, self.previous.get(i)["sentences"], etags))
+                reused_captions += 1
+            else:
+                sentences = caption_sentences[i]
+                ids = self.ids.take(caption_id_count(sentences))
+                rendered = render_caption(templates, i, caption_meta, sentences, ids, start_time,
+                                          self.user_material_path, self.animation_creator(ids[7]))
+                for name, array in streams.items():
+                    for text in rendered[name]:
+                        array.append_raw(text)
+                self.manifest_captions.append(caption_manifest(cap, caption_meta, len(sentences), etags))
 
             start_time = start_time + delta_duration
             total_time = total_time + delta_duration
             n += 1
 
+        logging.info("素材解析统计: %s" % get_probe_stats())
+        if self.probe_cache is not None:
+            # 本草稿命中的访问时间一次写入
+            self.probe_cache.flush()
+            values = self.metrics.values
+            logging.info("素材解析缓存统计: 命中 %d, 未命中 %d" % (values["probe_cache_hits"], values["probe_cache_misses"]))
+        if self.previous is not None:
+            logging.info("复用上一版字幕 %d 条" % reused_captions)
+            self.metrics.set("reused_captions", reused_captions)
         self.total_duration = total_time
         self.draft_meta_info['tm_duration'] = self.total_duration
         self.draft_content['duration'] = self.total_duration
-        self.draft_content['tracks'].append(tmp_video_track)
-        self.draft_content['tracks'].append(tmp_audio_track)
-        self.draft_content['tracks'].append(tmp_text_track)
+
+    def _reuse_caption(self, index, streams, start_time):
+        items = self.previous.caption_items(index)
+        delta = start_time - items['audio_segments'][0]['target_timerange']['start']
+        shift_segments(items['video_segments'], delta, source=True)
+        shift_segments(items['audio_segments'], delta)
+        shift_segments(items['text_segments'], delta)
+        # 草稿目录名带时间，素材的绝对路径需要换成新目录
+        for material in items['audios'] + items['videos']:
+            material['path'] = os.path.join(self.user_material_path, os.path.basename(material['path']))
+        for name, array in streams.items():
+            array.extend(items[name])
 
     def _save_draft(self):
-        with open(os.path.join(self.local_draft_path, 'draft_content.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.draft_content, f, ensure_ascii=False)
-        with open(os.path.join(self.local_draft_path, 'draft_meta_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.draft_meta_info, f, ensure_ascii=False)
+        if self.virtual_draft:
+            # 草稿json在_write_zip_entries中直接编码进zip
+            return
+        content_path = os.path.join(self.local_draft_path, 'draft_content.json')
+        meta_info_path = os.path.join(self.local_draft_path, 'draft_meta_info.json')
+        with open(content_path, 'w', encoding='utf-8') as f:
+            self.content_writer.write(f)
+        with open(meta_info_path, 'w', encoding='utf-8') as f:
+            self.meta_writer.write(f)
+        self.content_writer.close()
+        self.meta_writer.close()
+        # 字幕哈希清单随草稿一起打包，下次可以增量生成
+        write_manifest(os.path.join(self.local_draft_path, MANIFEST_NAME), self.manifest_captions,
+                       self.manifest_offsets, self._generation_options())
+        self.metrics.set("draft_content_bytes", os.path.getsize(content_path))
+        self.metrics.set("draft_meta_info_bytes", os.path.getsize(meta_info_path))
+
+    def _write_zip_entries(self, zfile, skip_name=None):
+        # json和模板文件deflate压缩，图片和音频直接存储
+        self.zip_stats = ZipStats()
+        if self.virtual_draft:
+            # 先写入草稿json，关闭writer后临时目录里的.spool随之删除
+            self._write_virtual_entries(zfile)
+        for folder_name, _, files in os.walk(self.local_path):
+            relative_folder_path = os.path.relpath(folder_name, self.local_path)
+            if relative_folder_path != ".":
+                zfile.write(folder_name, relative_folder_path)
+            for item_file in files:
+                if item_file == skip_name:
+                    continue
+                file_path = os.path.join(folder_name, item_file)
+                relative_file_path = os.path.join(relative_folder_path, item_file)
+                write_zip_entry(zfile, file_path, relative_file_path, self.zip_stats, self.zip_compress_level)
+        if self.previous is not None:
+            # 没有重新下载的素材直接复制上一版zip中的压缩数据
+            for file_name in self.reused_files:
+                self.previous.copy_material(zfile, file_name, self.draft_name, self.zip_stats)
+        logging.info("zip压缩统计: %s" % self.zip_stats.as_dict())
+        for key, value in self.zip_stats.as_dict().items():
+            self.metrics.set("zip_%s" % key, value)
+
+    def _write_virtual_entries(self, zfile):
+        # 临时目录里只有素材，说明文件、模板文件、草稿json和清单从内存写入
+        level = self.zip_compress_level
+        write_zip_data(zfile, self._readme_text().encode('utf-8'), README_NAME, self.zip_stats, level)
+        dirs, files = load_draft_files()
+        for relative_path in dirs:
+            zfile.write(os.path.join(DRAFT_FOLDER, relative_path), os.path.join(self.draft_name, relative_path))
+        for relative_path, data, date_time, mode in files:
+            write_zip_data(zfile, data, os.path.join(self.draft_name, relative_path), self.zip_stats, level,
+                           date_time, mode)
+        for file_name, writer, metric in (('draft_content.json', self.content_writer, "draft_content_bytes"),
+                                          ('draft_meta_info.json', self.meta_writer, "draft_meta_info_bytes")):
+            arcname = "%s/%s" % (self.draft_name, file_name)
+            with zip_text_entry(zfile, arcname, self.zip_stats, level) as fp:
+                writer.write(fp)
+            writer.close()
+            self.metrics.set(metric, zfile.getinfo(arcname).file_size)
+        manifest = script_to_draft_v2_json.dumps(manifest_document(self.manifest_captions, self.manifest_offsets,
+                                                                  self._generation_options()))
+        write_zip_data(zfile, manifest.encode('utf-8'), "%s/%s" % (self.draft_name, MANIFEST_NAME),
+                       self.zip_stats, level)
 
     def _zip_and_upload_draft(self):
         zip_file_name = datetime.now().strftime('%m月%d日%H时%M分')
+        if self.uploader_factory is not None:
+            return self._stream_zip_and_upload(f"{zip_file_name}.zip")
         zip_file_path = os.path.join(self.local_path, f"{zip_file_name}.zip")
         with zipfile.ZipFile(zip_file_path, 'w') as zfile:
-            for folder_name, _, files in os.walk(self.local_path):
-                relative_folder_path = os.path.relpath(folder_name, self.local_path)
-                if relative_folder_path != ".":
-                    zfile.write(folder_name, relative_folder_path)
-                for item_file in files:
-                    if item_file == f"{zip_file_name}.zip":
-                        continue
-                    file_path = os.path.join(folder_name, item_file)
-                    relative_file_path = os.path.join(relative_folder_path, item_file)
-                    zfile.write(file_path, relative_file_path)
+            self._write_zip_entries(zfile, f"{zip_file_name}.zip")
         # 上传到s3
         print("zip压缩成功，准备上传到S3 zip_file_path = " + zip_file_path)
+        self.metrics.set("zip_bytes", os.path.getsize(zip_file_path))
         uri = upload_s3(zip_file_path, 'application/zip')
         print("zip上传成功，uri = " + uri)
         return uri
 
+    def _stream_zip_and_upload(self, zip_name):
+        # zip不落盘，压缩出的数据按分片直接上传
+        stream = MultipartUploadStream(self.uploader_factory(zip_name))
+        try:
+            with zipfile.ZipFile(stream, 'w') as zfile:
+                self._write_zip_entries(zfile)
+            uri = stream.close()
+            self.metrics.set("zip_bytes", stream.bytes_written)
+        except BaseException:
+            stream.abort()
+            raise
+        print("zip分片上传成功，%d bytes, uri = %s" % (stream.bytes_written, uri))
+        return uri
+
     def _remove_folder(self):
         # 删除本地文件
         shutil.rmtree(self.local_path)
+        if self.previous is not None:
+            self.previous.close()
         pass
 
     def create_daft(self):
         print("开始合成草稿")
+        metrics = self.metrics
         try:
             # 准备文件夹
-            self.prepare_local_folder()
+            with metrics.stage("prepare_local_folder"):
+                self.prepare_local_folder()
             # 初始化草稿模版数据
-            self._init_draft()
+            with metrics.stage("init_draft"):
+                self._init_draft()
             # 下载素材
-            self._download_mats()
+            with metrics.stage("download_mats"):
+                self._download_mats()
             # 添加轨道数据
-            self._add_tracks()
+            with metrics.stage("add_tracks"):
+                self._add_tracks()
             # 保存轨道数据
-            self._save_draft()
+            with metrics.stage("save_draft"):
+                self._save_draft()
             # 添加随机关键帧
             if self.enable_key_frame == 1:
-                insert_keyframe(os.path.join(self.local_draft_path, 'draft_content.json'), 1.3)
+                with metrics.stage("insert_keyframe"):
+                    insert_keyframe(os.path.join(self.local_draft_path, 'draft_content.json'), 1.3)
             # 压缩并上传
-            uri = self._zip_and_upload_draft()
+            with metrics.stage("zip_and_upload_draft"):
+                uri = self._zip_and_upload_draft()
             # 删除临时文件
-            self._remove_folder()
+            with metrics.stage("remove_folder"):
+                self._remove_folder()
             logging.info("任务%s, 任务名%s, 生成成功draft: %s" % (self.chapter_id, self.draft_name, uri))
+            self._emit_metrics(True)
             return uri
         except:
             # 删除临时文件
-            self._remove_folder()
+            with metrics.stage("remove_folder"):
+                self._remove_folder()
             import traceback
             logging.error("任务%s, 任务名%s, 生成失败: %s" % (self.chapter_id, self.draft_name, traceback.format_exc()))
+            self._emit_metrics(False)
             return ""
 
+    def _emit_metrics(self, ok):
+        self.metrics.finish(ok)
+        try:
+            if self.metrics_path:
+                self.metrics.write_json_line(self.metrics_path)
+            if self.metrics_prom_path:
+                self.metrics.write_prometheus(self.metrics_prom_path)
+        except OSError:
+            logging.exception("写入草稿指标失败")
+
 
 if __name__ == '__main__':
     # caps = [
@@ -885,7 +1253,7 @@ if __name__ == '__main__':
     start_time_1 = time.time()
     # 读取json文件解析到caps
     with open('../data/json/draft.json', 'r', encoding='utf-8') as f:
-        json_data = json.load(f)
+        json_data = script_to_draft_v2_json.load(f)
     draft = CutDraft(str(json_data.get("chapter_id")),
                      str(json_data.get("uid")),
                      r"C:\Users\Kudou\AppData\Local\JianyingPro\User Data\Projects\com.lveditor.draft",
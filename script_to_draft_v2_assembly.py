@@ -0,0 +1,79 @@
+import os
+import time
+
+from modules.script_to_draft_v2_model import AudioMaterial, AudioSegment, Animation, Beats, Canvas, MetaMusic, \
+    MetaVideo, SoundChannelMapping, Speed, TextMaterial, TextSegment, VideoMaterial, VideoSegment
+from modules.script_to_draft_v2_subtitle import subtitle_timings
+
+# 单条字幕的素材和片段: 每条字幕的数据互不依赖，只有开始时间取决于前面所有字幕的时长
+# CutDraft按字幕顺序累加时长得到开始时间并分配id，再逐条生成、编码
+
+SEGMENT_ARRAYS = ('video_segments', 'audio_segments', 'text_segments')
+
+
+def caption_id_count(sentences):
+    # 每条字幕10个素材/片段id，每个小字幕2个
+    return 10 + 2 * len(sentences)
+
+
+def build_caption(index, caption_meta, sentences, ids, user_material_path, animation):
+    # 返回 {数组名: [模型对象]}，片段的开始时间相对这条字幕的开头
+    delta_duration, mp3file_create_time, width, height, imgfile_create_time = caption_meta
+    image_name = "%d.jpg" % index
+    audio_name = "%d.mp3" % index
+
+    user_image_path = os.path.join("./material", image_name)
+    user_audio_path = os.path.join("./material", audio_name)  # TODO: 这里这里！
+
+    # 处理draft_content文件
+    audio_uuid, sound_channel_mapping_uuid, speed_uuid, beats_uuid, audio_segment_uuid = ids[:5]
+
+    # 创建与meta文件关联ID并将其写入meta
+    music_id = ids[5].lower()
+    meta_music = MetaMusic(music_id, delta_duration, audio_name, user_audio_path, int(mp3file_create_time),
+                           int(time.time()), int(time.time() * 10 ** 6))
+    audio = AudioMaterial(delta_duration, audio_name, audio_uuid, music_id, os.path.join(user_material_path, audio_name))
+    audio_segment = AudioSegment([sound_channel_mapping_uuid, speed_uuid, beats_uuid], delta_duration, 0,
+                                 audio_uuid, audio_segment_uuid)
+
+    # 这一步处理图片信息
+    canvas_uuid, material_animation_uuid, tmp_video_uuid = ids[6:9]
+
+    meta_video = MetaVideo(tmp_video_uuid, delta_duration, image_name, user_image_path, int(imgfile_create_time),
+                           int(time.time()), int(time.time() * 10 ** 6), height, width)
+    video = VideoMaterial(delta_duration, image_name, tmp_video_uuid, int(height), int(width),
+                          os.path.join(user_material_path, image_name))
+
+    # 关键帧UUID
+    video_segment_uuid = ids[9]
+    video_segment = VideoSegment([canvas_uuid, speed_uuid, material_animation_uuid], delta_duration, 0,
+                                 tmp_video_uuid, video_segment_uuid)
+
+    # 这一步是处理字幕
+    # 小字幕的开始时间和时长(整数微秒)，最后一个小字幕和音频片段同时结束
+    texts = []
+    text_segments = []
+    for n, (sentence, (text_start_time, text_duration)) in enumerate(zip(
+            sentences, subtitle_timings(sentences, 0, delta_duration))):
+        # sentence为当前小字幕
+        text_uuid = ids[10 + 2 * n]
+        texts.append(TextMaterial(sentence, text_uuid))
+        # 添加到text的track中
+        text_segment_uuid = ids[11 + 2 * n]
+        text_segments.append(TextSegment([animation], text_duration, text_start_time, text_uuid, text_segment_uuid))
+
+    return dict(meta_materials=[meta_music, meta_video],
+                sound_channel_mappings=[SoundChannelMapping(sound_channel_mapping_uuid)],
+                speeds=[Speed(speed_uuid)], beats=[Beats(beats_uuid)], audios=[audio],
+                material_animations=[Animation(material_animation_uuid), Animation(material_animation_uuid)],
+                canvases=[Canvas(canvas_uuid)], videos=[video], texts=texts, video_segments=[video_segment],
+                audio_segments=[audio_segment], text_segments=text_segments)
+
+
+def render_caption(templates, index, caption_meta, sentences, ids, start_time, user_material_path, animation):
+    # 返回 {数组名: [编码好的json片段]}，片段平移到草稿时间轴上
+    items = build_caption(index, caption_meta, sentences, ids, user_material_path, animation)
+    for name in SEGMENT_ARRAYS:
+        for segment in items[name]:
+            segment.start_time += start_time
+    return {name: [item.render(templates) for item in array] for name, array in items.items()}
@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# 批量合成草稿: 多个CutDraft任务分发到进程池
+# 每个worker进程内复用同一个下载器(连接池)和解析好的模板，素材缓存目录所有进程共用
+# worker用spawn启动，不继承父进程的下载线程、SQLite连接、id缓冲区和锁；调用方的入口脚本需要 if __name__ == '__main__' 保护
+
+_worker_downloader = None
+
+
+def _init_worker(downloader_options):
+    global _worker_downloader
+    from modules import script_to_draft_v2
+    from modules.script_to_draft_v2_cache import MaterialCache
+    from modules.script_to_draft_v2_download import AsyncDownloader
+    from modules.script_to_draft_v2_template import compile_material_templates
+
+    cache = MaterialCache(script_to_draft_v2.CACHE_FOLDER, script_to_draft_v2.CACHE_MAX_BYTES)
+    _worker_downloader = AsyncDownloader(cache=cache, **downloader_options)
+    # 预先解析模板json，编译素材/片段模板
+    script_to_draft_v2.load_draft_templates()
+    draft = script_to_draft_v2.CutDraft("warmup", "warmup", "", [], 0, downloader=_worker_downloader,
+                                        probe_cache=False)
+    for compact in (False, True):
+        compile_material_templates(draft, compact)
+
+
+def _run_job(job):
+    from modules.script_to_draft_v2 import CutDraft
+
+    start = time.time()
+    kwargs = dict(job.get('kwargs') or {})
+    kwargs.setdefault('downloader', _worker_downloader)
+    draft = CutDraft(job['chapter_id'], job['draft_name'], job['user_path'], job['caps'],
+                     job.get('enable_key_frame', 0), **kwargs)
+    uri = draft.create_daft()
+    end = time.time()
+    return {"chapter_id": job['chapter_id'], "draft_name": job['draft_name'], "uri": uri, "ok": bool(uri),
+            "pid": os.getpid(), "started": start, "finished": end, "seconds": end - start}
+
+
+class BatchDraftService:
+    def __init__(self, processes=None, max_pending=None, downloader_options=None):
+        # max_pending: 已提交但未完成的任务上限，超过时暂停从队列取任务(背压)
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pending = max_pending or self.processes * 2
+        self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(downloader_options or {},))
+
+    def run(self, jobs):
+        # jobs是任务描述的可迭代对象(dict: chapter_id, draft_name, user_path, caps, enable_key_frame, kwargs)
+        # 从queue.Queue取任务可以传 iter(job_queue.get, None)
+        # 按完成顺序逐个产出结果，附带排队耗时和执行耗时
+        pending = {}
+        jobs = iter(jobs)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < self.max_pending:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[self._executor.submit(_run_job, job)] = (job, time.time())
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, submitted = pending.pop(future)
+                try:
+                    result = future.result()
+                    result["queued_seconds"] = result["started"] - submitted
+                except Exception as e:
+                    logging.exception("批量任务%s执行失败" % job.get('chapter_id'))
+                    result = {"chapter_id": job.get('chapter_id'), "draft_name": job.get('draft_name'), "uri": "",
+                              "ok": False, "error": repr(e)}
+                result["total_seconds"] = time.time() - submitted
+                logging.info("批量任务完成: %s" % result)
+                yield result
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,230 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.script_to_draft_v2_placeholder import make_mp3, make_png
+
+# 草稿合成基准: 生成假的图片/mp3/字幕，用本地HTTP服务提供下载，跑完整的CutDraft.create_daft
+# 每个规模在单独的子进程里运行，记录吞吐、峰值内存、json大小和各阶段耗时
+#
+#   python -m modules.script_to_draft_v2_bench --sizes 10 100 1000 --results bench_results.jsonl
+#   python -m modules.script_to_draft_v2_bench --compare bench_results.jsonl
+
+DEFAULT_SIZES = (10, 100, 1000)
+PUNCTUATION = "，。！？：“”"
+CHARACTERS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研"
+
+
+# ---- 素材生成 ----
+
+def make_subtitle(rng, length):
+    text = []
+    while len(text) < length:
+        text.extend(rng.choice(CHARACTERS) for _ in range(rng.randint(4, 16)))
+        text.append(rng.choice(PUNCTUATION))
+    return "".join(text[:length])
+
+
+def generate_materials(folder, count, audio_seconds, subtitle_length, width, height, seed=0):
+    # 生成count组素材，返回caps(地址里的{base}由HTTP服务地址替换)
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    caps = []
+    for i in range(count):
+        image_name = "%d.png" % i
+        audio_name = "%d.mp3" % i
+        if not os.path.exists(os.path.join(folder, image_name)):
+            make_png(os.path.join(folder, image_name), width, height, i)
+        if not os.path.exists(os.path.join(folder, audio_name)):
+            make_mp3(os.path.join(folder, audio_name), audio_seconds * rng.uniform(0.5, 1.5))
+        caps.append({"image_url": "{base}" + image_name, "audio_url": "{base}" + audio_name,
+                     "content_split": make_subtitle(rng, subtitle_length)})
+    return caps
+
+
+# ---- 本地HTTP服务 ----
+
+class _MaterialHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MaterialServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def serve_folder(folder):
+    server = _MaterialServer(("127.0.0.1", 0), functools.partial(_MaterialHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+# ---- 单个规模 ----
+
+def run_case(size, workdir, audio_seconds, subtitle_length, width, height, enable_key_frame, draft_folder=None):
+    from modules import script_to_draft_v2
+    from modules.script_to_draft_v2_cache import MaterialCache, ProbeCache
+    from modules.script_to_draft_v2_download import AsyncDownloader
+    from modules.script_to_draft_v2_zip import LocalMultipartUploader
+
+    material_folder = os.path.join(workdir, "materials")
+    caps = generate_materials(material_folder, size, audio_seconds, subtitle_length, width, height)
+    server, base = serve_folder(material_folder)
+    for cap in caps:
+        cap["image_url"] = cap["image_url"].format(base=base)
+        cap["audio_url"] = cap["audio_url"].format(base=base)
+
+    if draft_folder:
+        script_to_draft_v2.DRAFT_FOLDER = draft_folder
+    elif not os.path.isdir(script_to_draft_v2.DRAFT_FOLDER):
+        script_to_draft_v2.DRAFT_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cut_draft")
+    script_to_draft_v2.TEMP_FOLDER = os.path.join(workdir, "temp")
+    upload_folder = os.path.join(workdir, "upload")
+    os.makedirs(upload_folder, exist_ok=True)
+    metrics_path = os.path.join(workdir, "metrics_%d.jsonl" % size)
+    # 每个规模用全新的缓存目录和解析缓存，测的是冷启动，也不读写默认的./cache/probe.sqlite3
+    downloader = AsyncDownloader(cache=MaterialCache(os.path.join(workdir, "cache_%d" % size)))
+    probe_cache = ProbeCache(os.path.join(workdir, "probe_%d.sqlite3" % size))
+
+    start = time.perf_counter()
+    draft = script_to_draft_v2.CutDraft("bench_%d" % size, "bench", "/tmp/bench", caps, enable_key_frame,
+                                        downloader=downloader, probe_cache=probe_cache, metrics_path=metrics_path,
+                                        uploader_factory=lambda name: LocalMultipartUploader(upload_folder, name))
+    uri = draft.create_daft()
+    seconds = time.perf_counter() - start
+    downloader.close()
+    probe_cache.close()
+    server.shutdown()
+    if not uri:
+        raise RuntimeError("%d条字幕的草稿生成失败" % size)
+
+    with open(metrics_path, encoding="utf-8") as f:
+        metrics = json.loads(f.readlines()[-1])
+    return {
+        "captions": size,
+        "seconds": round(seconds, 6),
+        "captions_per_second": round(size / seconds, 3) if seconds else None,
+        # Linux下ru_maxrss单位是KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "draft_content_bytes": metrics["values"].get("draft_content_bytes"),
+        "draft_meta_info_bytes": metrics["values"].get("draft_meta_info_bytes"),
+        "zip_bytes": metrics["values"].get("zip_bytes"),
+        "stages": metrics["stages"],
+        "download_bytes": metrics["download"]["bytes"],
+    }
+
+
+# ---- 结果保存和对比 ----
+
+def current_version():
+    folder = os.path.dirname(os.path.realpath(__file__))
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=folder,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(path):
+    # 对比最近两个版本在相同规模下的结果
+    results = load_results(path)
+    versions = []
+    for result in results:
+        if result["version"] not in versions:
+            versions.append(result["version"])
+    if len(versions) < 2:
+        print("至少需要两个版本的结果")
+        return
+    old_version, new_version = versions[-2:]
+    latest = {}
+    for result in results:
+        latest[(result["version"], result["captions"])] = result
+    print("%-8s %-14s %-14s %-8s %-12s %-12s" % ("captions", old_version[:14], new_version[:14], "speedup",
+                                                  "old_rss_mb", "new_rss_mb"))
+    for size in sorted({captions for version, captions in latest if version == new_version}):
+        old, new = latest.get((old_version, size)), latest[(new_version, size)]
+        if old is None:
+            continue
+        print("%-8d %-14.3f %-14.3f %-8.2f %-12.1f %-12.1f" % (
+            size, old["seconds"], new["seconds"], old["seconds"] / new["seconds"], old["peak_rss_mb"],
+            new["peak_rss_mb"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CutDraft合成基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--audio-seconds", type=float, default=5.0)
+    parser.add_argument("--subtitle-length", type=int, default=60)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=180)
+    parser.add_argument("--key-frame", type=int, default=0)
+    parser.add_argument("--draft-folder", default=None, help="草稿模板目录，默认使用DRAFT_FOLDER")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--results", default="bench_results.jsonl")
+    parser.add_argument("--compare", metavar="RESULTS", default=None)
+    parser.add_argument("--case", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    if args.case is not None:
+        # 子进程: 只跑一个规模，把结果以json打印到最后一行
+        result = run_case(args.case, args.workdir, args.audio_seconds, args.subtitle_length, args.width,
+                          args.height, args.key_frame, args.draft_folder)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="draft_bench_")
+    version = current_version()
+    try:
+        for size in args.sizes:
+            case_dir = os.path.join(workdir, str(size))
+            output = subprocess.check_output(
+                [sys.executable, "-m", "modules.script_to_draft_v2_bench", "--case", str(size),
+                 "--workdir", case_dir, "--audio-seconds", str(args.audio_seconds),
+                 "--subtitle-length", str(args.subtitle_length), "--width", str(args.width),
+                 "--height", str(args.height), "--key-frame", str(args.key_frame)] +
+                (["--draft-folder", args.draft_folder] if args.draft_folder else []))
+            result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            result.update(version=version, python=platform.python_version(), timestamp=time.time(),
+                          audio_seconds=args.audio_seconds, subtitle_length=args.subtitle_length)
+            with open(args.results, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            print("%5d captions: %.3fs, %.1f captions/s, peak %.1fMB, draft_content %s bytes, stages %s" % (
+                size, result["seconds"], result["captions_per_second"], result["peak_rss_mb"],
+                result["draft_content_bytes"], result["stages"]))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import errno
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# 本地素材缓存: 以(地址, ETag, 大小)为键保存下载过的素材，草稿目录里只放硬链接
+# ProbeCache: 以同样的键(没有ETag时用大小和修改时间)保存素材的解析结果
+# 索引放在sqlite里，多个进程可以共用同一个缓存目录
+
+try:
+    import fcntl
+    FICLONE = 0x40049409
+except ImportError:
+    fcntl = None
+
+# ProbeCache命中时更新访问时间的批量大小
+TOUCH_BATCH = 256
+
+
+class CacheEntry:
+    def __init__(self, url, etag, size, blob):
+        self.url = url
+        self.etag = etag
+        self.size = size
+        self.blob = blob
+
+
+def link_or_copy(src, dst):
+    # 优先硬链接，跨设备时尝试reflink，最后才复制
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+class MaterialCache:
+    def __init__(self, root, max_bytes=10 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_path = os.path.join(root, "blobs")
+        self.tmp_path = os.path.join(root, "tmp")
+        os.makedirs(self.blob_path, exist_ok=True)
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._temp_counter = itertools.count()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # 缓存索引丢失最近几条记录也没关系，不需要每次提交都fsync
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, etag TEXT, size INTEGER, "
+                         "blob TEXT, last_access REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes_saved": self.bytes_saved}
+
+    def _blob_file(self, blob):
+        return os.path.join(self.blob_path, blob[:2], blob)
+
+    def temp_file(self, url):
+        # 下载中的临时文件放在缓存目录内，保证和blob同一个文件系统，可以原子rename
+        # 同一个地址可能同时有多个下载任务(同一个事件循环线程里)，加计数器区分
+        return os.path.join(self.tmp_path, "%s.%d.%d.tmp" % (hashlib.sha1(url.encode("utf-8")).hexdigest(),
+                                                             os.getpid(), next(self._temp_counter)))
+
+    def lookup(self, url):
+        # 查找地址对应的缓存，文件丢失或大小不符时视为没有缓存
+        with self._lock:
+            row = self._db.execute("SELECT etag, size, blob FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(url, row[0], row[1], row[2])
+        try:
+            if os.path.getsize(self._blob_file(entry.blob)) == entry.size:
+                return entry
+        except OSError:
+            pass
+        self._forget(url)
+        return None
+
+    def _forget(self, url):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+
+    def hit(self, entry, path):
+        # 缓存命中(服务端返回304或无需校验)，把blob链接到草稿目录
+        link_or_copy(self._blob_file(entry.blob), path)
+        with self._lock:
+            self._db.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), entry.url))
+            self.hits += 1
+            self.bytes_saved += entry.size
+
+    def store(self, url, temp_file, etag, path):
+        # 把下载好的临时文件放进缓存，再链接到草稿目录
+        size = os.path.getsize(temp_file)
+        blob = hashlib.sha256(("%s\n%s\n%d" % (url, etag or "", size)).encode("utf-8")).hexdigest()
+        blob_file = self._blob_file(blob)
+        os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+        os.replace(temp_file, blob_file)
+        with self._lock:
+            # 源文件更新过(ETag变化)，删除旧的blob
+            row = self._db.execute("SELECT blob FROM entries WHERE url = ?", (url,)).fetchone()
+            if row and row[0] != blob and os.path.exists(self._blob_file(row[0])):
+                os.remove(self._blob_file(row[0]))
+            self._db.execute("INSERT OR REPLACE INTO entries (url, etag, size, blob, last_access) "
+                             "VALUES (?, ?, ?, ?, ?)", (url, etag, size, blob, time.time()))
+            self.misses += 1
+        link_or_copy(blob_file, path)
+        self.evict()
+
+    def evict(self):
+        # 按最近访问时间淘汰，直到总大小不超过max_bytes
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute("SELECT url, size, blob FROM entries ORDER BY last_access").fetchall()
+            for url, size, blob in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                total -= size
+                try:
+                    os.remove(self._blob_file(blob))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        logging.warning("删除缓存文件失败: %s" % e)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def probe_cache_key(path, url=None, etag=None):
+    # 有ETag时用(地址, ETag, 大小)做键；没有ETag时用(地址或路径, 大小, 修改时间)
+    # 都只读文件属性，不读文件内容
+    stat = os.stat(path)
+    if url and etag:
+        key = "%s\n%s\n%d" % (url, etag, stat.st_size)
+        return "u:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+    key = "%s\n%d\n%d" % (url or os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    return "m:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ProbeCache:
+    # 素材解析结果缓存: 音频时长(微秒)和图片宽高，重复使用的素材不再解析
+    # 和MaterialCache一样用sqlite的WAL模式，多个worker进程可以同时读写
+    def __init__(self, path, max_entries=500000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS probes (key TEXT, kind TEXT, duration INTEGER, width INTEGER, "
+                         "height INTEGER, last_access REAL, PRIMARY KEY (key, kind))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS probes_last_access ON probes (last_access)")
+        self._puts = 0
+        # 命中时的访问时间先记在内存里，攒够一批再写入
+        self._touched = {}
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def get(self, kind, key):
+        # kind为"audio"时返回时长，为"image"时返回(宽, 高)，没有缓存返回None
+        with self._lock:
+            row = self._db.execute("SELECT duration, width, height FROM probes WHERE key = ? AND kind = ?",
+                                   (key, kind)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[(key, kind)] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_touched()
+        if kind == "audio":
+            return row[0]
+        return row[1], row[2]
+
+    def put(self, kind, key, value):
+        if kind == "audio":
+            duration, width, height = value, None, None
+        else:
+            duration, (width, height) = None, value
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO probes (key, kind, duration, width, height, last_access) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, kind, duration, width, height, time.time()))
+            self._puts += 1
+            evict = self._puts % 1000 == 0
+        if evict:
+            self.evict()
+
+    def _flush_touched(self):
+        # 调用方持有self._lock
+        if self._touched:
+            self._db.executemany("UPDATE probes SET last_access = ? WHERE key = ? AND kind = ?",
+                                 [(last_access, key, kind) for (key, kind), last_access in self._touched.items()])
+            self._touched = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush_touched()
+
+    def evict(self):
+        # 超过max_entries时删除最久没用过的记录
+        with self._lock:
+            self._flush_touched()
+            count = self._db.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute("DELETE FROM probes WHERE rowid IN (SELECT rowid FROM probes "
+                                 "ORDER BY last_access LIMIT ?)", (count - self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.close()
@@ -0,0 +1,539 @@
+import asyncio
+import collections
+import logging
+import os
+import random
+import re
+import ssl
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+# 基于asyncio的素材下载器: 按host复用keep-alive连接，限制单host和全局并发，分块流式写盘
+
+USER_AGENT = "dy_to_draft/2"
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+# 这些状态码以外的4xx重试也不会成功，直接判定失败
+RETRYABLE_CLIENT_ERRORS = (408, 416, 429)
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RetryPolicy:
+    # 重试策略: 指数退避加随机抖动，jitter=0.5表示实际等待时间在 [0.5, 1] 倍之间
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0, jitter=0.5, resume=True):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        # 重试时是否用Range从已下载的位置继续
+        self.resume = resume
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+class DownloadResult:
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.ok = False
+        self.status = None
+        self.bytes = 0
+        self.latency = 0.0
+        self.attempts = 0
+        self.error = None
+        # 发起请求时下载器的并发上限
+        self.concurrency = None
+        self.etag = None
+        self.last_modified = None
+        self.cache_hit = False
+        # 缓存命中时省下的字节数
+        self.bytes_saved = 0
+        # 断点续传复用的字节数
+        self.resumed_bytes = 0
+
+    def __repr__(self):
+        return "DownloadResult(url=%r, ok=%r, status=%r, bytes=%d, latency=%.3f, attempts=%d, cache_hit=%r)" % (
+            self.url, self.ok, self.status, self.bytes, self.latency, self.attempts, self.cache_hit)
+
+
+class DownloadReport:
+    # 一批素材的下载结果，results与提交顺序一致(被取消或不需要下载的为None)
+    def __init__(self, size):
+        self.results = [None] * size
+        self.failed = []
+        self.cancelled = 0
+        self.placeholders = []
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed or len(self.placeholders) == len(self.failed)
+
+    def as_dict(self):
+        return {"ok": self.ok, "completed": sum(1 for result in self.results if result is not None),
+                "failed": [{"index": index, "url": result.url, "status": result.status, "error": result.error,
+                            "attempts": result.attempts} for index, result in self.failed],
+                "cancelled": self.cancelled, "placeholders": list(self.placeholders),
+                "seconds": round(self.seconds, 6)}
+
+
+class MaterialDownloadError(DownloadError):
+    def __init__(self, report):
+        index, result = report.failed[0]
+        super().__init__("素材下载失败(第%d个): %s, %s" % (index, result.url, result.error))
+        self.report = report
+
+
+class AdaptiveLimiter:
+    # 按实测吞吐和延迟调整同时进行的请求数(AIMD): 每个统计窗口结束时
+    # 出现超时/连接错误，或者延迟明显升高而吞吐没有提升 -> 乘性减小；并发数已经用满 -> 加1
+    # 开始时处于慢启动阶段: 吞吐还在明显增长就翻倍，第一次不再增长或减小后转为加1
+    def __init__(self, min_limit=2, max_limit=32, initial=8, window=0.25, increase=1, decrease=0.75,
+                 latency_factor=2.0, slow_start_gain=0.2):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = max(self.min_limit, min(self.max_limit, initial))
+        # 实际能同时进行的请求数(每个host的连接数 x 正在下载的host数)，并发上限不超过它
+        self.ceiling = self.max_limit
+        self.window = window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.slow_start_gain = slow_start_gain
+        self.slow_start = True
+        self.in_flight = 0
+        self.base_latency = None
+        self.last_throughput = None
+        self.adjustments = 0
+        self._waiters = collections.deque()
+        self._reset_window(time.perf_counter())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_latencies = []
+        self._window_congested = False
+        self._saturated = self.in_flight >= self.limit
+
+    async def acquire(self):
+        while self.in_flight >= self.limit:
+            self._saturated = True
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已经被唤醒但任务取消了，把名额让给下一个
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self._saturated = True
+
+    def release(self, size, latency, congested=False):
+        self.in_flight -= 1
+        self._window_bytes += size
+        self._window_latencies.append(latency)
+        self._window_congested = self._window_congested or congested
+        now = time.perf_counter()
+        if now - self._window_start >= self.window:
+            self._adjust(now)
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _adjust(self, now):
+        throughput = self._window_bytes / (now - self._window_start)
+        latencies = sorted(self._window_latencies)
+        latency = latencies[len(latencies) // 2]
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        inflated = latency > self.base_latency * self.latency_factor
+        old = self.limit
+        if self._window_congested or (inflated and self.last_throughput is not None
+                                      and throughput <= self.last_throughput):
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+            self.slow_start = False
+        elif self._saturated:
+            if self.slow_start and (self.last_throughput is None
+                                    or throughput >= self.last_throughput * (1 + self.slow_start_gain)):
+                self.limit = min(self.ceiling, self.limit * 2)
+            else:
+                self.slow_start = False
+                self.limit = min(self.ceiling, self.limit + self.increase)
+        if self.limit != old:
+            self.adjustments += 1
+            logging.debug("下载并发数 %d -> %d, 吞吐 %.0f B/s, 延迟中位数 %.3fs" % (old, self.limit, throughput, latency))
+        self.last_throughput = throughput
+        self._reset_window(now)
+
+    def set_ceiling(self, ceiling):
+        self.ceiling = max(self.min_limit, min(self.max_limit, ceiling))
+        self.limit = min(self.limit, self.ceiling)
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "min_limit": self.min_limit,
+                "max_limit": self.max_limit, "adjustments": self.adjustments}
+
+
+class _HostPool:
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.idle = []
+        # 正在这个host上排队或下载的请求数
+        self.users = 0
+
+
+class AsyncDownloader:
+    def __init__(self, max_connections=32, max_per_host=16, chunk_size=64 * 1024, timeout=30, max_retries=3,
+                 retry_delay=1, cache=None, retry_policy=None, min_connections=2, initial_connections=8,
+                 adaptive=True):
+        # adaptive为True时同时进行的请求数在[min_connections, max_connections]之间自动调整，否则固定为max_connections
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.min_connections = min_connections
+        self.initial_connections = initial_connections
+        self.adaptive = adaptive
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        # 默认重试策略，submit时可以按任务单独指定
+        self.retry_policy = retry_policy or RetryPolicy(max_retries, retry_delay)
+        # MaterialCache，为None时不使用缓存
+        self.cache = cache
+        self._ssl = ssl.create_default_context()
+        self._pools = {}
+        self._limiter = None
+        self._active_hosts = 0
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---- 事件循环在后台线程中常驻，连接池可以跨多个草稿复用 ----
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="draft-downloader", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, url, path, retry_policy=None, etag=None):
+        # 提交一个下载任务，返回concurrent.futures.Future，结果为DownloadResult
+        # etag是调用方已有副本的ETag，服务端返回304时不写path，由调用方沿用自己的副本
+        return asyncio.run_coroutine_threadsafe(self.fetch(url, path, retry_policy, etag), self._ensure_loop())
+
+    def download_all(self, jobs, retry_policy=None):
+        # jobs: [(url, path), ...]，按提交顺序返回DownloadResult列表
+        futures = [self.submit(url, path, retry_policy) for url, path in jobs]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_idle(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        self._pools = {}
+        self._limiter = None
+        self._active_hosts = 0
+
+    def concurrency_stats(self):
+        limiter = self._limiter
+        if limiter is None:
+            return {"limit": self.initial_connections if self.adaptive else self.max_connections, "in_flight": 0}
+        return limiter.stats()
+
+    async def _close_idle(self):
+        for pool in self._pools.values():
+            while pool.idle:
+                _, writer = pool.idle.pop()
+                writer.close()
+
+    # ---- 连接池 ----
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _HostPool(self.max_per_host)
+        return pool
+
+    async def _connect(self, key):
+        # 返回 (reader, writer, 是否复用的空闲连接)
+        pool = self._pool(key)
+        while pool.idle:
+            reader, writer = pool.idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None), self.timeout)
+        return reader, writer, False
+
+    def _enter_host(self, pool):
+        pool.users += 1
+        if pool.users == 1:
+            self._active_hosts += 1
+            self._limiter.set_ceiling(self.max_per_host * self._active_hosts)
+
+    def _leave_host(self, pool):
+        pool.users -= 1
+        if pool.users == 0:
+            self._active_hosts -= 1
+            if self._active_hosts:
+                self._limiter.set_ceiling(self.max_per_host * self._active_hosts)
+
+    def _release(self, key, reader, writer, reusable):
+        if reusable and not writer.is_closing():
+            self._pool(key).idle.append((reader, writer))
+        else:
+            writer.close()
+
+    # ---- HTTP/1.1 ----
+
+    async def _read_headers(self, reader):
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError("连接被关闭")
+            version, status = line.decode("latin-1").split(" ", 2)[:2]
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            # 跳过100 Continue之类的中间响应
+            if not status.startswith("1"):
+                return version, int(status), headers
+
+    async def _read_body(self, reader, headers, f):
+        # 把响应体写入f(为None时丢弃)，返回 (字节数, 连接能否复用)
+        size = 0
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                chunk_size = int(line.split(b";")[0].strip() or b"0", 16)
+                if chunk_size == 0:
+                    while await asyncio.wait_for(reader.readline(), self.timeout) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return size, True
+                size += await self._copy(reader, chunk_size, f)
+                await asyncio.wait_for(reader.readline(), self.timeout)
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            return await self._copy(reader, length, f), True
+        # 没有长度信息，读到连接关闭为止
+        while True:
+            chunk = await asyncio.wait_for(reader.read(self.chunk_size), self.timeout)
+            if not chunk:
+                return size, False
+            size += len(chunk)
+            if f is not None:
+                f.write(chunk)
+
+    async def _copy(self, reader, length, f):
+        remaining = length
+        while remaining:
+            chunk = await asyncio.wait_for(reader.read(min(remaining, self.chunk_size)), self.timeout)
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+            if f is not None:
+                f.write(chunk)
+        return length
+
+    async def _fetch_once(self, url, path, result, etag=None, offset=0):
+        # offset>0时用Range请求从offset继续下载，If-Range保证文件没有变化，否则服务端返回完整内容
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https"):
+                raise DownloadError("不支持的地址: %s" % url)
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+            host = parts.hostname if parts.port is None else "%s:%d" % (parts.hostname, parts.port)
+
+            request = ("GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept-Encoding: identity\r\n"
+                       "Connection: keep-alive\r\n" % (target, host, USER_AGENT))
+            if offset:
+                # If-Range只能用强ETag，弱ETag时用Last-Modified(_resume_offset保证至少有一个可用)
+                validator = result.etag if result.etag and not result.etag.startswith("W/") else result.last_modified
+                request += "Range: bytes=%d-\r\nIf-Range: %s\r\n" % (offset, validator)
+            elif etag:
+                request += "If-None-Match: %s\r\n" % etag
+            request = (request + "\r\n").encode("latin-1")
+
+            # 先拿到这个host的连接名额再占并发名额，在host上排队的请求不算进并发数
+            # 只统计请求本身的耗时，不含排队时间
+            pool = self._pool(key)
+            self._enter_host(pool)
+            try:
+                async with pool.semaphore:
+                    await self._limiter.acquire()
+                    result.concurrency = self._limiter.limit
+                    request_start = time.perf_counter()
+                    congested = True
+                    size = 0
+                    try:
+                        redirect, size = await self._request(key, request, url, path, result, etag, offset)
+                        congested = False
+                    except (DownloadError, asyncio.CancelledError):
+                        # 服务端正常返回了错误状态码，或者任务被取消，都不算拥塞
+                        congested = False
+                        raise
+                    finally:
+                        self._limiter.release(size, time.perf_counter() - request_start, congested)
+            finally:
+                self._leave_host(pool)
+            if redirect is None:
+                return
+            url = redirect
+        raise DownloadError("重定向次数过多: %s" % url)
+
+    async def _request(self, key, request, url, path, result, etag, offset):
+        # 发送一次请求，返回 (重定向地址或None, 本次传输的字节数)
+        reader, writer, reused = await self._connect(key)
+        reusable = False
+        try:
+            try:
+                writer.write(request)
+                await writer.drain()
+                version, status, headers = await self._read_headers(reader)
+            except (OSError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # 空闲连接可能已被服务端关闭，换一个新连接重发
+                writer.close()
+                reader, writer, _ = await self._connect(key)
+                writer.write(request)
+                await writer.drain()
+                version, status, headers = await self._read_headers(reader)
+            result.status = status
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            if status in REDIRECT_CODES and "location" in headers:
+                _, body_reusable = await self._read_body(reader, headers, None)
+                reusable = keep_alive and body_reusable
+                return urljoin(url, headers["location"]), 0
+            if status == 304 and etag:
+                reusable = keep_alive
+                return None, 0
+            if status == 416 and offset:
+                # 已下载的部分不可用，删掉重新下载
+                _, body_reusable = await self._read_body(reader, headers, None)
+                reusable = keep_alive and body_reusable
+                os.remove(path)
+                raise DownloadError("HTTP 416, 从头重新下载: %s" % url)
+            if status not in (200, 206) or (status == 206 and not offset):
+                _, body_reusable = await self._read_body(reader, headers, None)
+                reusable = keep_alive and body_reusable
+                raise DownloadError("HTTP %d: %s" % (status, url))
+            expected = None
+            if status == 206:
+                match = CONTENT_RANGE.match(headers.get("content-range", ""))
+                if match is None or int(match.group(1)) != offset:
+                    raise DownloadError("Content-Range与请求不符: %s" % headers.get("content-range"))
+                if match.group(3) != "*":
+                    expected = int(match.group(3))
+                mode = "ab"
+            else:
+                offset = 0
+                if "content-length" in headers and "transfer-encoding" not in headers:
+                    expected = int(headers["content-length"])
+                result.etag = headers.get("etag")
+                result.last_modified = headers.get("last-modified")
+                mode = "wb"
+            with open(path, mode) as f:
+                size, body_reusable = await self._read_body(reader, headers, f)
+            reusable = keep_alive and body_reusable
+            # 校验文件总长度，不完整的部分留给下次重试续传
+            if expected is not None and os.path.getsize(path) != expected:
+                raise DownloadError("文件长度不符: %d != %d, %s" % (os.path.getsize(path), expected, url))
+            result.resumed_bytes += offset
+            result.bytes = offset + size
+            return None, size
+        finally:
+            self._release(key, reader, writer, reusable)
+
+    def _resume_offset(self, target, result, policy):
+        # 上次请求拿到了校验用的ETag/Last-Modified才续传，弱ETag不能用于If-Range
+        if not policy.resume or result.attempts == 0 or not os.path.exists(target):
+            return 0
+        if result.etag and not result.etag.startswith("W/"):
+            return os.path.getsize(target)
+        if result.last_modified:
+            return os.path.getsize(target)
+        return 0
+
+    async def fetch(self, url, path, retry_policy=None, etag=None):
+        if self._limiter is None:
+            if self.adaptive:
+                self._limiter = AdaptiveLimiter(self.min_connections, self.max_connections, self.initial_connections)
+            else:
+                self._limiter = AdaptiveLimiter(self.max_connections, self.max_connections, self.max_connections)
+        policy = retry_policy or self.retry_policy
+        result = DownloadResult(url, path)
+        start = time.perf_counter()
+        # 有缓存时先下载到缓存目录，带上ETag做条件请求，304直接用缓存
+        # 没有缓存时先写临时文件，完整下载后再rename，目标路径上不会出现半个文件
+        entry = self.cache.lookup(url) if self.cache else None
+        # 条件请求的ETag: 缓存里有就用缓存的，否则用调用方传入的
+        validator = entry.etag if entry is not None and entry.etag else etag
+        target = self.cache.temp_file(url) if self.cache else "%s.%d.part" % (path, id(result))
+        try:
+            while result.attempts < policy.max_retries:
+                offset = self._resume_offset(target, result, policy)
+                result.attempts += 1
+                try:
+                    await self._fetch_once(url, target, result, validator, offset)
+                    if result.status == 304:
+                        result.etag = validator
+                        if entry is not None and entry.etag == validator:
+                            self.cache.hit(entry, path)
+                            result.cache_hit = True
+                            result.bytes_saved = entry.size
+                    elif self.cache:
+                        self.cache.store(url, target, result.etag, path)
+                    else:
+                        os.replace(target, path)
+                    result.ok = True
+                    break
+                except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, DownloadError) as e:
+                    result.error = repr(e)
+                    if isinstance(e, DownloadError) and result.status and 400 <= result.status < 500 \
+                            and result.status not in RETRYABLE_CLIENT_ERRORS:
+                        logging.error("下载失败，HTTP %d 不再重试：%s" % (result.status, url))
+                        break
+                    logging.warning("下载失败，正在重试... (%d/%d) %s: %r" % (
+                        result.attempts, policy.max_retries, url, e))
+                    if result.attempts < policy.max_retries:
+                        await asyncio.sleep(policy.delay(result.attempts))
+            else:
+                logging.error("下载失败，已达到最大重试次数：%s" % url)
+        finally:
+            # 失败或被取消(CancelledError)时删除临时文件
+            if not result.ok and os.path.exists(target):
+                os.remove(target)
+        result.latency = time.perf_counter() - start
+        return result
@@ -0,0 +1,122 @@
+import os
+import random
+import re
+import threading
+import uuid
+
+# 批量生成草稿素材和片段的UUID4: 一次读取一大块随机数，整批转成大写字符串，之后按需取用
+# 传入seed时用固定种子的伪随机数，同样的输入得到同样的id，用于基准和对比输出
+
+DEFAULT_BATCH = 4096
+# 每16字节: 第7字节高4位是版本号4，第9字节高2位是variant 10
+_VERSION_MASK = bytes([0xff] * 6 + [0x0f, 0xff, 0x3f] + [0xff] * 7)
+_VERSION_BITS = bytes([0] * 6 + [0x40, 0, 0x80] + [0] * 7)
+_UUID_GROUPS = re.compile('(.{8})(.{4})(.{4})(.{4})(.{12})')
+_format_uuid = '%s-%s-%s-%s-%s'.__mod__
+
+
+class UuidAllocator:
+    def __init__(self, seed=None, batch=DEFAULT_BATCH):
+        self.seed = seed
+        self.batch = batch
+        self._rng = random.Random(seed) if seed is not None else None
+        self._ids = []
+        self._next = 0
+        # 缓冲区属于哪个进程: fork出的子进程不能沿用父进程还没用完的随机id
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # 整批一起设置版本位，不逐个处理
+        self._mask = int.from_bytes(_VERSION_MASK * batch, "big")
+        self._bits = int.from_bytes(_VERSION_BITS * batch, "big")
+
+    def _random_bytes(self, size):
+        if self._rng is None:
+            return os.urandom(size)
+        return self._rng.getrandbits(size * 8).to_bytes(size, "big")
+
+    def _fill(self):
+        # 整块写入版本号4和RFC 4122的variant位，转成十六进制后按8-4-4-4-12切分
+        size = 16 * self.batch
+        value = (int.from_bytes(self._random_bytes(size), "big") & self._mask) | self._bits
+        text = value.to_bytes(size, "big").hex().upper()
+        self._ids = list(map(_format_uuid, _UUID_GROUPS.findall(text)))
+        self._next = 0
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._rng is None and self._pid != os.getpid():
+            self._ids = []
+            self._next = 0
+
+    def new(self):
+        # 返回大写的UUID4字符串，与 str(uuid.uuid4()).upper() 格式一致
+        with self._lock:
+            self._check_fork()
+            if self._next >= len(self._ids):
+                self._fill()
+            value = self._ids[self._next]
+            self._next += 1
+            return value
+
+    def take(self, count):
+        # 一次取count个id，按顺序返回
+        with self._lock:
+            self._check_fork()
+            result = []
+            while len(result) < count:
+                if self._next >= len(self._ids):
+                    self._fill()
+                end = min(len(self._ids), self._next + count - len(result))
+                result.extend(self._ids[self._next:end])
+                self._next = end
+            return result
+
+
+_default_allocator = None
+
+
+def get_default_allocator():
+    # 不指定种子时所有草稿共用一个分配器
+    global _default_allocator
+    if _default_allocator is None:
+        _default_allocator = UuidAllocator()
+    return _default_allocator
+
+
+def _reset_after_fork():
+    # 子进程重新建默认分配器，不复制父进程的缓冲区，也不继承fork时可能被持有的锁
+    global _default_allocator
+    _default_allocator = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def id_allocator(seed=None):
+    if seed is None:
+        return get_default_allocator()
+    return UuidAllocator(seed)
+
+
+if __name__ == '__main__':
+    import time
+
+    count = 1000000
+    start = time.perf_counter()
+    for _ in range(count):
+        str(uuid.uuid4()).upper()
+    uuid4_time = time.perf_counter() - start
+
+    allocator = UuidAllocator()
+    start = time.perf_counter()
+    for _ in range(count):
+        allocator.new()
+    allocator_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    UuidAllocator().take(count)
+    take_time = time.perf_counter() - start
+    print("%d个id uuid4: %.3fs, 分配器: %.3fs (%.1fx), 批量take: %.3fs (%.1fx)" % (
+        count, uuid4_time, allocator_time, uuid4_time / allocator_time, take_time, uuid4_time / take_time))
+
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+
+from modules import script_to_draft_v2_json
+from modules.script_to_draft_v2_zip import copy_zip_entry
+
+# 增量生成: 每个草稿附带一份字幕哈希清单，下次只处理有变化的字幕
+# 清单记录每条字幕的素材地址、ETag、解析结果和小字幕个数，据此从上一版草稿json中切出每条字幕的素材和片段
+# 地址没变的素材带上ETag做条件请求，服务端确认没有变化(同一地址可能被覆盖，如重新生成的配音)才复用
+
+MANIFEST_NAME = "draft_manifest.json"
+MANIFEST_VERSION = 1
+
+# 每条字幕在各个数组中占的元素个数，None表示等于小字幕个数
+CAPTION_ITEMS = {
+    "meta_materials": 2,
+    "sound_channel_mappings": 1,
+    "speeds": 1,
+    "beats": 1,
+    "audios": 1,
+    "material_animations": 2,
+    "canvases": 1,
+    "videos": 1,
+    "texts": None,
+    "video_segments": 1,
+    "audio_segments": 1,
+    "text_segments": None,
+}
+
+
+def caption_hash(cap):
+    text = json.dumps([cap['image_url'], cap['audio_url'], cap['content_split']], ensure_ascii=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def caption_manifest(cap, caption_meta, sentences, etags):
+    # etags是 (图片ETag, 音频ETag)，没有时为None
+    delta_duration, mp3file_create_time, width, height, imgfile_create_time = caption_meta
+    return {"hash": caption_hash(cap), "image_url": cap['image_url'], "audio_url": cap['audio_url'],
+            "image_etag": etags[0], "audio_etag": etags[1],
+            "audio": [delta_duration, mp3file_create_time], "image": [width, height, imgfile_create_time],
+            "sentences": sentences}
+
+
+def same_material(result, etag):
+    # 条件请求确认素材与上一版相同: 返回304，或者重新下载后ETag没变
+    return etag is not None and result is not None and result.ok and result.etag == etag
+
+
+def manifest_document(captions, offsets, options):
+    # options是影响片段内容的生成参数(关键帧等)，与上一版不同时不能复用
+    return {"version": MANIFEST_VERSION, "options": options, "offsets": offsets, "captions": captions}
+
+
+def write_manifest(path, captions, offsets, options):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(script_to_draft_v2_json.dumps(manifest_document(captions, offsets, options)))
+
+
+class PreviousDraft:
+    # 上一版草稿的zip，读取其中的json和清单，提供按字幕复用素材和片段的接口
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.zfile = zipfile.ZipFile(zip_path)
+        try:
+            manifest_name = next(name for name in self.zfile.namelist()
+                                 if os.path.basename(name) == MANIFEST_NAME)
+        except StopIteration:
+            self.zfile.close()
+            raise ValueError("%s中没有%s，无法增量生成" % (zip_path, MANIFEST_NAME))
+        self.draft_folder = os.path.dirname(manifest_name)
+        manifest = script_to_draft_v2_json.loads(self.zfile.read(manifest_name))
+        if manifest.get("version") != MANIFEST_VERSION:
+            self.zfile.close()
+            raise ValueError("不支持的清单版本: %s" % manifest.get("version"))
+        self.options = manifest.get("options")
+        self.captions = manifest["captions"]
+        self.offsets = manifest["offsets"]
+        content = script_to_draft_v2_json.loads(self.zfile.read(self.draft_folder + "/draft_content.json"))
+        meta_info = script_to_draft_v2_json.loads(self.zfile.read(self.draft_folder + "/draft_meta_info.json"))
+        self.arrays = dict(content['materials'])
+        tracks = {track['type']: track['segments'] for track in content['tracks']}
+        self.arrays["video_segments"] = tracks.get("video", [])
+        self.arrays["audio_segments"] = tracks.get("audio", [])
+        self.arrays["text_segments"] = tracks.get("text", [])
+        self.arrays["meta_materials"] = meta_info['draft_materials'][0]['value']
+        # 每条字幕在texts/text_segments中的起始位置
+        self.text_starts = []
+        position = 0
+        for caption in self.captions:
+            self.text_starts.append(position)
+            position += caption["sentences"]
+
+    def get(self, index):
+        if index < len(self.captions):
+            return self.captions[index]
+        return None
+
+    def unchanged(self, index, cap):
+        caption = self.get(index)
+        return caption is not None and caption["hash"] == caption_hash(cap)
+
+    def reusable_meta(self, index, cap):
+        # 返回 (音频解析结果, 图片解析结果)，地址变化的那一项为None
+        caption = self.get(index)
+        if caption is None:
+            return None, None
+        audio = tuple(caption["audio"]) if caption["audio_url"] == cap['audio_url'] else None
+        image = tuple(caption["image"]) if caption["image_url"] == cap['image_url'] else None
+        return audio, image
+
+    def material_etags(self, index, cap):
+        # 返回上一版 (图片ETag, 音频ETag)，地址变化或没有记录ETag的那一项为None
+        caption = self.get(index)
+        if caption is None:
+            return None, None
+        image = caption.get("image_etag") if caption["image_url"] == cap['image_url'] else None
+        audio = caption.get("audio_etag") if caption["audio_url"] == cap['audio_url'] else None
+        return image, audio
+
+    def caption_items(self, index):
+        # 上一版草稿中第index条字幕的所有素材和片段
+        caption = self.captions[index]
+        items = {}
+        for name, per_caption in CAPTION_ITEMS.items():
+            offset = self.offsets.get(name, 0)
+            if per_caption is None:
+                start = offset + self.text_starts[index]
+                items[name] = self.arrays[name][start:start + caption["sentences"]]
+            else:
+                start = offset + index * per_caption
+                items[name] = self.arrays[name][start:start + per_caption]
+        return items
+
+    def copy_material(self, zfile, file_name, draft_folder, stats=None):
+        # 把上一版的material/file_name原样复制到新草稿目录下
+        info = self.zfile.getinfo("%s/material/%s" % (self.draft_folder, file_name))
+        return copy_zip_entry(self.zfile, info, zfile, "%s/material/%s" % (draft_folder, file_name), stats)
+
+    def close(self):
+        self.zfile.close()
+
+
+def shift_segments(segments, delta, source=False):
+    # 字幕前面的时长变化后，整体平移片段的开始时间；视频片段的source_timerange也跟着开始时间走
+    if delta:
+        for segment in segments:
+            segment['target_timerange']['start'] += delta
+            if source:
+                segment['source_timerange']['start'] += delta
+    return segments
+
+
+def open_previous_draft(zip_path, options):
+    # 上一版不可用或生成参数不同时返回None，退回全量生成
+    try:
+        previous = PreviousDraft(zip_path)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        logging.exception("读取上一版草稿失败，全量生成: %s" % zip_path)
+        return None
+    if previous.options != options:
+        logging.info("生成参数与上一版不同(%s -> %s)，全量生成: %s" % (previous.options, options, zip_path))
+        previous.close()
+        return None
+    return previous
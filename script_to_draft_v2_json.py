@@ -0,0 +1,145 @@
+import json
+import os
+
+# 可替换的json后端: 安装了orjson时用orjson，否则用标准库
+# 两种后端的语义一致: 不转义非ASCII字符，保持dict的键顺序
+# 默认格式与 json.dumps(obj, ensure_ascii=False) 逐字节一致；compact格式去掉分隔符后的空格，orjson可以直接生成
+# 环境变量 DRAFT_JSON_BACKEND=auto|orjson|stdlib 可以指定后端
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StdlibBackend:
+    name = "stdlib"
+
+    def __init__(self):
+        self._encoders = {
+            False: json.JSONEncoder(ensure_ascii=False).encode,
+            True: json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode,
+        }
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def encoder(self, compact=False):
+        return self._encoders[compact]
+
+
+class OrjsonBackend(StdlibBackend):
+    name = "orjson"
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # 超过64位的整数、NaN等orjson不支持的写法交给标准库
+            return json.loads(data)
+
+    def encoder(self, compact=False):
+        if not compact:
+            # orjson没有带空格的分隔符，默认格式仍然用标准库保证逐字节一致
+            return super().encoder(False)
+        stdlib_encode = super().encoder(True)
+
+        def encode(obj):
+            try:
+                return orjson.dumps(obj).decode("utf-8")
+            except TypeError:
+                # 超过64位的整数等
+                return stdlib_encode(obj)
+        return encode
+
+
+_backend = None
+
+
+def set_backend(name="auto"):
+    global _backend
+    if name == "orjson" or (name == "auto" and orjson is not None):
+        if orjson is None:
+            raise ImportError("没有安装orjson")
+        _backend = OrjsonBackend()
+    elif name in ("stdlib", "auto"):
+        _backend = StdlibBackend()
+    else:
+        raise ValueError("未知的json后端: %s" % name)
+    return _backend
+
+
+def get_backend():
+    if _backend is None:
+        set_backend(os.environ.get("DRAFT_JSON_BACKEND", "auto"))
+    return _backend
+
+
+def loads(data):
+    return get_backend().loads(data)
+
+
+def load(fp):
+    return get_backend().loads(fp.read())
+
+
+def encoder(compact=False):
+    return get_backend().encoder(compact)
+
+
+def dumps(obj, compact=False):
+    return get_backend().encoder(compact)(obj)
+
+
+def _synthetic_draft(segments):
+    # 和draft_content结构相近的数据: 每个片段带uuid、时间范围、嵌套的配置和中文字幕
+    import uuid
+
+    materials = []
+    track = []
+    for i in range(segments):
+        material_id = str(uuid.uuid4()).upper()
+        materials.append({"id": material_id, "type": "text", "content": "{\"text\":\"第%d句字幕，测试\"}" % i,
+                          "font_size": 7.0, "alignment": 1, "check_flag": 7, "words": [], "path": "",
+                          "text_color": "#FFFFFF", "line_spacing": 0.02, "ratio": 1.0})
+        track.append({"id": str(uuid.uuid4()).upper(), "material_id": material_id, "extra_material_refs": [],
+                      "source_timerange": None, "target_timerange": {"duration": 1000000 + i, "start": i * 1000000},
+                      "clip": {"alpha": 1.0, "flip": {"horizontal": False, "vertical": False}, "rotation": 0.0,
+                               "scale": {"x": 1.0, "y": 1.0}, "transform": {"x": 0.0, "y": -0.73}},
+                      "visible": True, "volume": 1.0, "render_index": 14000 + i})
+    return {"id": str(uuid.uuid4()).upper(), "duration": segments * 1000000, "materials": {"texts": materials},
+            "tracks": [{"type": "text", "segments": track}]}
+
+
+def benchmark(segments, repeat=3):
+    import time
+
+    draft = _synthetic_draft(segments)
+    reference = json.dumps(draft, ensure_ascii=False)
+    timings = {}
+    backends = [StdlibBackend()] + ([OrjsonBackend()] if orjson is not None else [])
+    for backend in backends:
+        for compact in (False, True):
+            encode = backend.encoder(compact)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                text = encode(draft)
+            timings["%s dumps%s" % (backend.name, " compact" if compact else "")] = (time.perf_counter() - start) / repeat
+            if compact:
+                assert json.loads(text) == draft
+            else:
+                assert text == reference
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parsed = backend.loads(reference)
+        timings["%s loads" % backend.name] = (time.perf_counter() - start) / repeat
+        assert parsed == draft
+    return len(reference.encode("utf-8")), timings
+
+
+if __name__ == '__main__':
+    for segments in (1000, 10000):
+        size, timings = benchmark(segments)
+        print("%d个片段, %d bytes" % (segments, size))
+        for name, seconds in timings.items():
+            print("  %-22s %.4fs" % (name, seconds))
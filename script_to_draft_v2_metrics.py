@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 草稿合成的分阶段耗时和指标，每个任务输出一条json记录，可选输出Prometheus文本格式
+# 下载默认只输出汇总，每个文件的明细(items)需要单独开启
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class DraftMetrics:
+    def __init__(self, chapter_id, draft_name, download_items=False):
+        self.chapter_id = chapter_id
+        self.draft_name = draft_name
+        self.download_items = download_items
+        self.started = time.time()
+        self.finished = None
+        self.ok = None
+        self.stages = {}
+        self.downloads = []
+        self.probes = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def record_download(self, url, path, ok, size, latency, **extra):
+        item = {"url": url, "file": os.path.basename(path), "ok": ok, "bytes": size, "latency": round(latency, 6)}
+        item.update(extra)
+        with self._lock:
+            self.downloads.append(item)
+
+    def record_probe(self, index, seconds):
+        with self._lock:
+            self.probes[index] = seconds
+
+    def set(self, key, value):
+        with self._lock:
+            self.values[key] = value
+
+    def add(self, key, value=1):
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def finish(self, ok):
+        self.ok = ok
+        self.finished = time.time()
+
+    def as_record(self):
+        with self._lock:
+            latencies = [item["latency"] for item in self.downloads]
+            probes = list(self.probes.values())
+            record = {
+                "chapter_id": self.chapter_id,
+                "draft_name": self.draft_name,
+                "ok": self.ok,
+                "started": self.started,
+                "total_seconds": round((self.finished or time.time()) - self.started, 6),
+                "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                "download": {
+                    "files": len(self.downloads),
+                    "failed": sum(1 for item in self.downloads if not item["ok"]),
+                    "bytes": sum(item["bytes"] for item in self.downloads),
+                    "latency_p50": _percentile(latencies, 50),
+                    "latency_p95": _percentile(latencies, 95),
+                    "latency_max": max(latencies) if latencies else 0.0,
+                },
+                "probe": {
+                    "captions": len(probes),
+                    "seconds_total": round(sum(probes), 6),
+                    "seconds_p95": round(_percentile(probes, 95), 6),
+                    "seconds_max": round(max(probes), 6) if probes else 0.0,
+                },
+                "values": dict(self.values),
+            }
+            if self.download_items:
+                record["download"]["items"] = list(self.downloads)
+            return record
+
+    def write_json_line(self, path):
+        record = self.as_record()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    def prometheus_text(self):
+        record = self.as_record()
+        labels = 'chapter_id="%s"' % _escape_label(self.chapter_id)
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s gauge" % name)
+            for extra_labels, value in samples:
+                lines.append("%s{%s%s} %s" % (name, labels, extra_labels, value))
+
+        metric("draft_ok", "1 if the draft was generated successfully", [("", int(bool(record["ok"])))])
+        metric("draft_total_seconds", "Wall time of create_daft", [("", record["total_seconds"])])
+        metric("draft_stage_seconds", "Wall time per create_daft stage",
+               [(',stage="%s"' % name, seconds) for name, seconds in record["stages"].items()])
+        download = record["download"]
+        metric("draft_download_files", "Material files downloaded", [("", download["files"])])
+        metric("draft_download_failed_files", "Material files that failed to download", [("", download["failed"])])
+        metric("draft_download_bytes", "Material bytes downloaded", [("", download["bytes"])])
+        metric("draft_download_latency_seconds", "Per-file download latency",
+               [(',quantile="0.5"', download["latency_p50"]), (',quantile="0.95"', download["latency_p95"]),
+                (',quantile="1"', download["latency_max"])])
+        probe = record["probe"]
+        metric("draft_probe_seconds_total", "Total duration/size probe time", [("", probe["seconds_total"])])
+        metric("draft_probe_seconds_max", "Slowest per-caption probe", [("", probe["seconds_max"])])
+        numeric = [(key, value) for key, value in sorted(record["values"].items())
+                   if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        for key, value in numeric:
+            metric("draft_%s" % key, key.replace("_", " "), [("", value)])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # textfile collector会读取整个文件，先写临时文件再替换
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
@@ -0,0 +1,167 @@
+# 草稿的类型化模型: 素材和片段只保存每个实例不同的字段，固定字段在编码时由预编译模板补上
+# 字段名和模板的slot名一致，render()的结果与creator生成的dict编码后完全一致
+# 片段可以先不填开始时间，所有字幕的时长确定后再统一赋值和编码
+
+
+def text_content(content):
+    return "{\"text\":\"%s\",\"styles\":[{\"strokes\":[{\"content\":{\"solid\":{\"color\":[0,0,0]}},\"width\":0.08}],\"size\":7,\"fill\":{\"content\":{\"solid\":{\"color\":[1,0.870588,0]}}},\"range\":[0,%d]}]}" % (content, len(content))
+
+
+class DraftItem:
+    __slots__ = ()
+    template = None
+
+    def __init__(self, *args):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+
+    def values(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def render(self, templates):
+        return templates[self.template].render(**self.values())
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(repr(value) for value in self.__getstate__()))
+
+
+class Speed(DraftItem):
+    __slots__ = ('speed_uuid',)
+    template = 'speed'
+
+
+class Beats(DraftItem):
+    __slots__ = ('uuid',)
+    template = 'beats'
+
+
+class SoundChannelMapping(DraftItem):
+    __slots__ = ('audio_channel_mapping_uuid',)
+    template = 'sound_channel_mapping'
+
+
+class Canvas(DraftItem):
+    __slots__ = ('uuid',)
+    template = 'canvas'
+
+
+class Animation(DraftItem):
+    __slots__ = ('uuid',)
+    template = 'animation'
+
+
+class AudioMaterial(DraftItem):
+    __slots__ = ('duration', 'file_name', 'audio_uuid', 'local_material_id', 'path')
+    template = 'audio'
+
+
+class VideoMaterial(DraftItem):
+    __slots__ = ('duration', 'file_name', 'video_uuid', 'height', 'width', 'path')
+    template = 'video'
+
+
+class TextMaterial(DraftItem):
+    # 只保存小字幕文本，带样式的content在编码时生成
+    __slots__ = ('text', 'text_uuid')
+    template = 'text'
+
+    def values(self):
+        return {"content": text_content(self.text), "text_uuid": self.text_uuid}
+
+
+class MetaMusic(DraftItem):
+    __slots__ = ('music_uuid', 'duration', 'filename', 'filepath', 'create_time', 'import_time', 'import_time_ms')
+    template = 'meta_music'
+
+
+class MetaVideo(DraftItem):
+    __slots__ = ('video_uuid', 'duration', 'filename', 'filepath', 'create_time', 'import_time', 'import_time_ms',
+                 'height', 'width')
+    template = 'meta_video'
+
+
+class AudioSegment(DraftItem):
+    __slots__ = ('material_uuid_list', 'duration', 'start_time', 'audio_uuid', 'audio_segment_uuid')
+    template = 'audio_segment'
+
+
+class VideoSegment(DraftItem):
+    __slots__ = ('material_uuid_list', 'duration', 'start_time', 'video_uuid', 'video_segment_uuid')
+    template = 'video_segment'
+
+
+class TextSegment(DraftItem):
+    __slots__ = ('material_uuid_list', 'duration', 'start_time', 'text_uuid', 'text_segment_uuid')
+    template = 'text_segment'
+
+
+class Track(DraftItem):
+    # 轨道本身只有id和类型，片段由StreamingJsonWriter接管
+    __slots__ = ('id', 'type')
+
+    def to_dict(self):
+        return dict(attribute=0, flag=0, id=self.id, segments=[], type=self.type)
+
+
+if __name__ == '__main__':
+    import gc
+    import json
+    import time
+    import tracemalloc
+
+    from modules.script_to_draft_v2 import CutDraft
+    from modules.script_to_draft_v2_template import compile_material_templates
+
+    # 1万个视频片段+文字片段+文字素材: creator生成的dict和模型对象的内存占用、编码耗时
+    segments = 10000
+    draft = CutDraft("benchmark", "benchmark", "/tmp/benchmark", [], 0)
+    templates = compile_material_templates(draft)
+
+    def build_dicts():
+        items = []
+        for i in range(segments):
+            refs = ["C%d" % i, "S%d" % i, "A%d" % i]
+            items.append(draft.video_segement_creator(refs, 1000 + i, i * 1000, "V%d" % i, "VS%d" % i))
+            items.append(draft.text_segment_creator(refs, 1000 + i, i * 1000, "T%d" % i, "TS%d" % i))
+            items.append(draft.text_creator("第%d句字幕" % i, "T%d" % i))
+        return items
+
+    def build_models():
+        items = []
+        for i in range(segments):
+            refs = ["C%d" % i, "S%d" % i, "A%d" % i]
+            items.append(VideoSegment(refs, 1000 + i, i * 1000, "V%d" % i, "VS%d" % i))
+            items.append(TextSegment(refs, 1000 + i, i * 1000, "T%d" % i, "TS%d" % i))
+            items.append(TextMaterial("第%d句字幕" % i, "T%d" % i))
+        return items
+
+    results = {}
+    for name, build in (("dict", build_dicts), ("model", build_models)):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        items = build()
+        seconds = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = items
+        print("%-5s 构建 %.3fs, 内存 %.1f MB, 每个片段 %d bytes" % (name, seconds, size / 1024 ** 2, size / segments))
+
+    start = time.perf_counter()
+    for item in results["model"]:
+        item.render(templates)
+    model_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for item in results["dict"]:
+        json.dumps(item, ensure_ascii=False)
+    print("模型编码 %.3fs, json.dumps %.3fs" % (model_time, time.perf_counter() - start))
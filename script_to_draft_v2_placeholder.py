@@ -0,0 +1,65 @@
+import os
+import struct
+import zlib
+
+# 只用标准库生成的图片和静音mp3: 下载失败时的占位素材，基准测试里的假素材
+
+PLACEHOLDER_WIDTH = 1280
+PLACEHOLDER_HEIGHT = 960
+PLACEHOLDER_AUDIO_SECONDS = 3.0
+
+
+def make_png(path, width, height, seed=0):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    color = bytes(((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    raw = b"".join(b"\0" + color * width for _ in range(height))
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+                chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+def make_mp3(path, seconds, bitrate=128):
+    # 静音的MPEG1 Layer III CBR帧，第一帧带LAME风格的Info标签记录帧数
+    sample_rate = 44100
+    frames = max(1, int(seconds * sample_rate / 1152))
+    bitrate_index = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320].index(bitrate)
+    base_size = 144 * bitrate * 1000 // sample_rate
+    remainder = 144 * bitrate * 1000 % sample_rate
+    out = bytearray()
+    info = bytearray(bytes([0xFF, 0xFB, bitrate_index << 4, 0x44]) + b"\0" * (base_size - 4))
+    info[36:40] = b"Info"
+    info[40:48] = struct.pack(">II", 1, frames)
+    out += info
+    accumulated = 0
+    for _ in range(frames):
+        accumulated += remainder
+        padding = 0
+        if accumulated >= sample_rate:
+            accumulated -= sample_rate
+            padding = 1
+        out += bytes([0xFF, 0xFB, (bitrate_index << 4) | (padding << 1), 0x44]) + b"\0" * (base_size + padding - 4)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def ensure_placeholders(folder, image=None, audio=None):
+    # 返回 {"image": 路径, "audio": 路径}，没有指定的占位素材在folder里生成(黑色图片、静音音频)
+    os.makedirs(folder, exist_ok=True)
+    if image is None:
+        image = os.path.join(folder, "placeholder.png")
+        if not os.path.exists(image):
+            _write_atomic(image, lambda path: make_png(path, PLACEHOLDER_WIDTH, PLACEHOLDER_HEIGHT))
+    if audio is None:
+        audio = os.path.join(folder, "placeholder.mp3")
+        if not os.path.exists(audio):
+            _write_atomic(audio, lambda path: make_mp3(path, PLACEHOLDER_AUDIO_SECONDS))
+    return {"image": image, "audio": audio}
+
+
+def _write_atomic(path, make):
+    # 多个进程可能同时生成同一个占位文件，先写临时文件再替换
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    make(temp_path)
+    os.replace(temp_path, path)
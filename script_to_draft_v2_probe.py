@@ -0,0 +1,308 @@
+import os
+import struct
+import threading
+
+# 只读文件头的素材探测，避免为每个文件启动ffmpeg子进程
+
+# MPEG版本位 -> 版本号, 1 = MPEG1, 2 = MPEG2, 25 = MPEG2.5
+_MPEG_VERSIONS = {0b00: 25, 0b10: 2, 0b11: 1}
+# Layer位 -> layer号
+_MPEG_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    25: [11025, 12000, 8000],
+}
+
+# 帧头之后的侧信息长度，用于定位Xing/Info标签: (是否MPEG1, 是否单声道)
+_SIDE_INFO_SIZES = {(True, False): 32, (True, True): 17, (False, False): 17, (False, True): 9}
+
+# 帧扫描最多读取的帧数，防止损坏文件导致长时间扫描
+MAX_SCAN_FRAMES = 200000
+
+_stats_lock = threading.Lock()
+# header: Xing/Info/VBRI解析成功, scan: CBR帧扫描成功, fallback: 解析失败或没有标签的VBR回退到MoviePy
+# image_header: 图片文件头解析成功, image_fallback: 回退到PIL
+probe_stats = {"header": 0, "scan": 0, "fallback": 0, "image_header": 0, "image_fallback": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        probe_stats[key] += 1
+
+
+def record_probe_fallback():
+    _count("fallback")
+
+
+def get_probe_stats():
+    with _stats_lock:
+        return dict(probe_stats)
+
+
+def _parse_frame_header(header):
+    # 解析4字节mpeg音频帧头，返回 (帧长度, 每帧采样数, 采样率, 比特率kbps, 是否单声道, 版本) 或 None
+    if len(header) < 4:
+        return None
+    b1, b2, b3 = header[1], header[2], header[3]
+    if header[0] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = _MPEG_VERSIONS.get((b1 >> 3) & 0b11)
+    layer = _MPEG_LAYERS.get((b1 >> 1) & 0b11)
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0b11
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0b1
+    mono = ((b3 >> 6) & 0b11) == 0b11
+
+    if layer == 1:
+        samples = 384
+        frame_size = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        frame_size = 144 * bitrate * 1000 // sample_rate + padding
+    else:
+        samples = 576
+        frame_size = 72 * bitrate * 1000 // sample_rate + padding
+    return frame_size, samples, sample_rate, bitrate, mono, version
+
+
+def _skip_id3v2(f):
+    # 跳过文件头部的ID3v2标签，返回音频数据的起始偏移
+    offset = 0
+    while True:
+        f.seek(offset)
+        tag = f.read(10)
+        if len(tag) < 10 or tag[:3] != b"ID3":
+            return offset
+        size = (tag[6] & 0x7F) << 21 | (tag[7] & 0x7F) << 14 | (tag[8] & 0x7F) << 7 | (tag[9] & 0x7F)
+        footer = 10 if tag[5] & 0x10 else 0
+        offset += 10 + size + footer
+
+
+def _find_first_frame(f, offset, limit=64 * 1024):
+    # 从offset开始寻找第一个合法帧头(要求下一帧也能对上，避免误判)
+    f.seek(offset)
+    data = f.read(limit)
+    pos = data.find(b"\xFF")
+    while 0 <= pos < len(data) - 4:
+        info = _parse_frame_header(data[pos:pos + 4])
+        if info:
+            next_pos = pos + info[0]
+            if next_pos + 4 > len(data) or _parse_frame_header(data[next_pos:next_pos + 4]):
+                return offset + pos, info
+        pos = data.find(b"\xFF", pos + 1)
+    return None, None
+
+
+def _read_vbr_frames(frame, info):
+    # 读取Xing/Info或VBRI标签中的总帧数，没有则返回None
+    _, _, _, _, mono, version = info
+    xing_offset = 4 + _SIDE_INFO_SIZES[(version == 1, mono)]
+    tag = frame[xing_offset:xing_offset + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", frame[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 0x1:
+            return struct.unpack(">I", frame[xing_offset + 8:xing_offset + 12])[0]
+        return None
+    # VBRI标签固定在帧头后32字节
+    if frame[36:40] == b"VBRI":
+        return struct.unpack(">I", frame[50:54])[0]
+    return None
+
+
+def _ffmpeg_seconds(duration):
+    # ffmpeg打印Duration时先换算成整数微秒，再四舍五入到百分之一秒，MoviePy解析的就是这个字符串
+    duration_us = int(round(duration * 10 ** 6)) + 5000
+    secs, us = divmod(duration_us, 10 ** 6)
+    return secs + (100 * us // 10 ** 6) / 100
+
+
+def probe_mp3_duration(filename):
+    # 解析mp3时长(秒)，结果与MoviePy的AudioFileClip.duration一致；解析失败返回None
+    try:
+        file_size = os.path.getsize(filename)
+        with open(filename, "rb") as f:
+            data_offset = _skip_id3v2(f)
+            first_offset, info = _find_first_frame(f, data_offset)
+            if info is None:
+                return None
+            frame_size, samples, sample_rate, bitrate, _, _ = info
+
+            f.seek(first_offset)
+            frame = f.read(max(frame_size, 64))
+            frames = _read_vbr_frames(frame, info)
+            if frames:
+                _count("header")
+                return _ffmpeg_seconds(frames * samples / sample_rate)
+
+            # 没有VBR标签: 扫描所有帧头，确认是CBR
+            bitrates = set()
+            pos = first_offset
+            count = 0
+            while count < MAX_SCAN_FRAMES:
+                f.seek(pos)
+                header = f.read(4)
+                frame_info = _parse_frame_header(header)
+                if frame_info is None:
+                    break
+                bitrates.add(frame_info[3])
+                pos += frame_info[0]
+                count += 1
+            # 没有标签的VBR文件ffmpeg用文件大小和估计的码率算时长，这里算不出同样的值，交给MoviePy
+            if len(bitrates) != 1:
+                return None
+            _count("scan")
+            # CBR文件ffmpeg按码率估算时长
+            return _ffmpeg_seconds((file_size - data_offset) * 8 / (bitrate * 1000))
+    except (OSError, struct.error):
+        return None
+
+
+# ---- 图片分辨率 ----
+
+# 不含DHT(C4)、JPG(C8)、DAC(CC)的SOF标记
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xFF":
+            continue
+        marker = f.read(1)
+        while marker == b"\xFF":
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        # 没有长度字段的独立标记
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack(">H", length)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _webp_size(header):
+    chunk = header[12:16]
+    if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and header[20] == 0x2F:
+        bits = struct.unpack("<I", header[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return (int.from_bytes(header[24:27], "little") + 1,
+                int.from_bytes(header[27:30], "little") + 1)
+    return None
+
+
+def probe_image_size(image_path):
+    # 只读文件头解析JPEG/PNG/WebP的宽高，与PIL的Image.size一致；不支持的格式返回None
+    try:
+        with open(image_path, "rb") as f:
+            header = f.read(32)
+            size = None
+            if header[:2] == b"\xFF\xD8":
+                size = _jpeg_size(f)
+            elif header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+                size = struct.unpack(">II", header[16:24])
+            elif header[:4] == b"RIFF" and header[8:12] == b"WEBP" and len(header) >= 30:
+                size = _webp_size(header)
+    except (OSError, struct.error):
+        return None
+    if size is not None:
+        _count("image_header")
+    return size
+
+
+def record_image_fallback():
+    _count("image_fallback")
+
+
+def probe_image_sizes(image_paths, max_workers=8, fallback=None):
+    # 并行解析一批图片的宽高，返回 {路径: (宽, 高)}；解析失败的交给fallback(通常是PIL)
+    from concurrent.futures import ThreadPoolExecutor
+
+    def probe(path):
+        size = probe_image_size(path)
+        if size is None and fallback is not None:
+            record_image_fallback()
+            size = fallback(path)
+        return path, size
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(probe, image_paths))
+
+
+def _pil_size(path):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def benchmark_image_sizes(folder, repeat=3):
+    # 对比PIL和文件头解析读取folder下所有图片宽高的耗时
+    import time
+
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+    timings = {}
+    for name, run in (("pil", lambda: {path: _pil_size(path) for path in paths}),
+                      ("header", lambda: {path: probe_image_size(path) for path in paths}),
+                      ("header_batch", lambda: probe_image_sizes(paths, fallback=_pil_size))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = run()
+        timings[name] = (time.perf_counter() - start) / repeat
+        if name == "pil":
+            expected = result
+        else:
+            mismatched = [path for path in paths if tuple(result[path] or ()) != tuple(expected[path])]
+            assert not mismatched, "分辨率不一致: %s" % mismatched[:5]
+    return len(paths), timings
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        folder = sys.argv[1]
+    else:
+        # 没有指定目录时生成几百张不同格式和尺寸的图片
+        from PIL import Image
+
+        folder = tempfile.mkdtemp()
+        for i in range(300):
+            image = Image.new("RGB", (640 + i, 360 + i % 97), (i % 256, 80, 160))
+            image.save(os.path.join(folder, "%d.%s" % (i, ("jpg", "png", "webp")[i % 3])))
+    count, timings = benchmark_image_sizes(folder)
+    print("图片数: %d" % count)
+    for name, seconds in timings.items():
+        print("%s: %.4fs (%.1fx)" % (name, seconds, timings["pil"] / seconds))
@@ -0,0 +1,81 @@
+import random
+import re
+
+# 字幕切分和计时: 按标点把每条字幕切成小字幕，时长按字数比例分配
+# 时间全部用整数微秒，按累计字数计算每个边界，最后一个小字幕正好结束在音频片段的末尾
+
+SENTENCE_PUNCTUATION = '。,，！!.？?“：”'
+# 直接匹配两个标点之间的非空文本，等价于按标点split后去掉空串
+SENTENCE_PATTERN = re.compile('[^%s]+' % re.escape(SENTENCE_PUNCTUATION))
+
+
+def split_sentences(content):
+    return SENTENCE_PATTERN.findall(content)
+
+
+def split_captions(contents):
+    # 一次处理所有字幕，返回每条字幕的小字幕列表
+    findall = SENTENCE_PATTERN.findall
+    return [findall(content) for content in contents]
+
+
+def subtitle_timings(sentences, start_time, duration):
+    # 返回每个小字幕的 (开始时间, 时长)，单位微秒
+    # 第k个边界 = start_time + duration * 前k个小字幕的字数 // 总字数，相邻边界相减得到时长，不会累积误差
+    total = sum(map(len, sentences))
+    if not total:
+        return []
+    timings = []
+    chars = 0
+    begin = start_time
+    for sentence in sentences:
+        chars += len(sentence)
+        end = start_time + duration * chars // total
+        timings.append((begin, end - begin))
+        begin = end
+    return timings
+
+
+def caption_timings(captions, durations, start_time=0):
+    # captions是split_captions的结果，durations是每条字幕的音频时长(微秒)
+    # 返回每条字幕的小字幕计时列表，字幕之间首尾相接
+    result = []
+    for sentences, duration in zip(captions, durations):
+        result.append(subtitle_timings(sentences, start_time, duration))
+        start_time += duration
+    return result
+
+
+def make_script(total_chars=100000, seed=0):
+    # 随机生成约total_chars字的脚本，用于测试和基准: 每条字幕由若干段文字和1-2个标点组成，包含空句和连续标点
+    # 返回 (字幕文本列表, 每条字幕的音频时长列表)
+    rng = random.Random(seed)
+    alphabet = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工abc xyz"
+    contents = []
+    for _ in range(2000):
+        parts = []
+        for _ in range(rng.randint(1, 8)):
+            parts.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+            parts.append(rng.choice(SENTENCE_PUNCTUATION) * rng.randint(1, 2))
+        contents.append("".join(parts))
+    while sum(map(len, contents)) < total_chars:
+        contents.append(rng.choice(contents))
+    durations = [rng.randint(500000, 8000000) for _ in contents]
+    return contents, durations
+
+
+if __name__ == '__main__':
+    import time
+
+    # 10万字的脚本切分和计时的耗时；正确性和与原实现的对比见 tests/test_subtitle.py
+    contents, durations = make_script()
+    print("字幕数: %d, 总字数: %d" % (len(contents), sum(map(len, contents))))
+
+    start = time.perf_counter()
+    captions = split_captions(contents)
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    caption_timings(captions, durations)
+    timing_seconds = time.perf_counter() - start
+    print("切分: %.4fs, 计时: %.4fs" % (split_seconds, timing_seconds))
@@ -0,0 +1,122 @@
+import json
+import re
+import time
+
+from modules.script_to_draft_v2_json import encoder
+
+# 预编译素材/片段模板: 每种结构只用json编码一次，生成时只替换变化的字段
+# 渲染结果与 json.dumps(creator(...), ensure_ascii=False) 完全一致，compact模板与紧凑格式一致
+
+_SLOT_PATTERN = re.compile('"__slot_(\\w+)__"')
+
+# 按是否紧凑格式分别缓存
+_templates = {}
+
+
+def slot(name):
+    return "__slot_%s__" % name
+
+
+class JsonTemplate:
+    def __init__(self, shape, compact=False):
+        self.compact = compact
+        self._encode = encoder(compact)
+        parts = _SLOT_PATTERN.split(self._encode(shape))
+        self.head = parts[0]
+        # (字段名, 字段后面的固定json片段)
+        self.slots = list(zip(parts[1::2], parts[2::2]))
+
+    def __getstate__(self):
+        # 编码函数不能pickle，进程模式下在子进程里按compact重新取
+        return self.head, self.slots, self.compact
+
+    def __setstate__(self, state):
+        self.head, self.slots, self.compact = state
+        self._encode = encoder(self.compact)
+
+    def render(self, **values):
+        encode = self._encode
+        out = [self.head]
+        for name, fragment in self.slots:
+            out.append(encode(values[name]))
+            out.append(fragment)
+        return "".join(out)
+
+
+def compile_material_templates(draft, compact=False):
+    # 用CutDraft的creator生成模板结构，进程内只编译一次
+    if compact in _templates:
+        return _templates[compact]
+
+    audio = draft.audio_creator(slot('duration'), slot('file_name'), slot('audio_uuid'), slot('local_material_id'))
+    audio['path'] = slot('path')
+
+    meta_music = draft.meta_music_creator(slot('music_uuid'), slot('duration'), slot('filename'), slot('filepath'), 0)
+    meta_music.update(create_time=slot('create_time'), import_time=slot('import_time'),
+                      import_time_ms=slot('import_time_ms'))
+
+    meta_video = draft.meta_video_creator(slot('video_uuid'), slot('duration'), slot('filename'), slot('filepath'), 0,
+                                          slot('height'), slot('width'))
+    meta_video.update(create_time=slot('create_time'), import_time=slot('import_time'),
+                      import_time_ms=slot('import_time_ms'))
+
+    video = draft.video_creator(slot('duration'), slot('file_name'), slot('video_uuid'), slot('height'), slot('width'))
+    video['path'] = slot('path')
+
+    text = draft.text_creator("", slot('text_uuid'))
+    text['content'] = slot('content')
+
+    segment_args = (slot('material_uuid_list'), slot('duration'), slot('start_time'))
+    templates = {
+        'speed': JsonTemplate(draft.speeds_creator(slot('speed_uuid')), compact),
+        'beats': JsonTemplate(draft.beats_creator(slot('uuid')), compact),
+        'audio': JsonTemplate(audio, compact),
+        'sound_channel_mapping': JsonTemplate(
+            draft.sound_channel_mappings_creator(slot('audio_channel_mapping_uuid')), compact),
+        'meta_music': JsonTemplate(meta_music, compact),
+        'audio_segment': JsonTemplate(draft.audio_segment_creator(*segment_args, slot('audio_uuid'),
+                                                                  slot('audio_segment_uuid')), compact),
+        'meta_video': JsonTemplate(meta_video, compact),
+        'canvas': JsonTemplate(draft.canvases_creator(slot('uuid')), compact),
+        'animation': JsonTemplate(draft.animation_creator(slot('uuid')), compact),
+        'video_segment': JsonTemplate(draft.video_segement_creator(*segment_args, slot('video_uuid'),
+                                                                   slot('video_segment_uuid')), compact),
+        'video': JsonTemplate(video, compact),
+        'text_segment': JsonTemplate(draft.text_segment_creator(*segment_args, slot('text_uuid'),
+                                                                slot('text_segment_uuid')), compact),
+        'text': JsonTemplate(text, compact),
+    }
+    _templates[compact] = templates
+    return templates
+
+
+def benchmark(draft, segments=10000):
+    # 对比creator+json.dumps和模板渲染生成segments个视频/文字片段的耗时
+    templates = compile_material_templates(draft)
+    refs = ["A", "B", "C"]
+
+    start = time.perf_counter()
+    creator_out = []
+    for i in range(segments):
+        creator_out.append(json.dumps(draft.video_segement_creator(refs, 1000 + i, i * 1000, "V%d" % i, "S%d" % i),
+                                      ensure_ascii=False))
+        creator_out.append(json.dumps(draft.text_creator("字幕%d" % i, "T%d" % i), ensure_ascii=False))
+    creator_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template_out = []
+    for i in range(segments):
+        template_out.append(templates['video_segment'].render(material_uuid_list=refs, duration=1000 + i,
+                                                              start_time=i * 1000, video_uuid="V%d" % i,
+                                                              video_segment_uuid="S%d" % i))
+        template_out.append(templates['text'].render(content=draft.text_content("字幕%d" % i), text_uuid="T%d" % i))
+    template_time = time.perf_counter() - start
+    return creator_time, template_time
+
+
+if __name__ == '__main__':
+    from modules.script_to_draft_v2 import CutDraft
+
+    draft = CutDraft("benchmark", "benchmark", "/tmp/benchmark", [], 0)
+    creator_time, template_time = benchmark(draft)
+    print("creator: %.3fs, template: %.3fs, 加速: %.1fx" % (creator_time, template_time, creator_time / template_time))
@@ -0,0 +1,93 @@
+import os
+import re
+
+from modules.script_to_draft_v2_json import encoder
+
+# 增量写草稿json: 素材数组和轨道片段在生成时就编码写入临时文件，最后按原顺序拼接
+# 输出与 json.dump(obj, f, ensure_ascii=False) 逐字节一致；compact=True时与紧凑格式一致
+
+
+class StreamedArray:
+    def __init__(self, path, items, compact=False):
+        self.path = path
+        self.count = 0
+        self._encode = encoder(compact)
+        self._separator = "," if compact else ", "
+        self._file = open(path, 'w', encoding='utf-8')
+        for item in items:
+            self.append(item)
+
+    def append(self, item):
+        self.append_raw(self._encode(item))
+
+    def append_raw(self, text):
+        # text是已经编码好的json片段
+        if self.count:
+            self._file.write(self._separator)
+        self._file.write(text)
+        self.count += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class StreamingJsonWriter:
+    def __init__(self, skeleton, spool_dir, compact=False):
+        # skeleton是最终json的骨架，被stream()接管的数组会替换成占位字符串
+        self.skeleton = skeleton
+        self.spool_dir = spool_dir
+        self.compact = compact
+        self.arrays = []
+        self._token = os.urandom(8).hex()
+        if not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+
+    def stream(self, container, key):
+        # 接管container[key]这个数组，原有元素会先写入
+        index = len(self.arrays)
+        array = StreamedArray(os.path.join(self.spool_dir, "%s_%d.part" % (self._token, index)),
+                              container[key], self.compact)
+        container[key] = "__stream_%s_%d__" % (self._token, index)
+        self.arrays.append(array)
+        return array
+
+    def write(self, fp):
+        # 把骨架和各个数组拼接写入fp，返回写入的字符数
+        text = encoder(self.compact)(self.skeleton)
+        parts = re.split('"__stream_%s_(\\d+)__"' % self._token, text)
+        written = 0
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                fp.write(part)
+                written += len(part)
+                continue
+            array = self.arrays[int(part)]
+            array.close()
+            fp.write("[")
+            with open(array.path, 'r', encoding='utf-8') as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    fp.write(chunk)
+                    written += len(chunk)
+            fp.write("]")
+            written += 2
+        return written
+
+    def close(self):
+        for array in self.arrays:
+            array.close()
+            if os.path.exists(array.path):
+                os.remove(array.path)
+        # 多个writer可以共用同一个临时目录，最后一个关闭时删除目录
+        if os.path.isdir(self.spool_dir) and not os.listdir(self.spool_dir):
+            os.rmdir(self.spool_dir)
@@ -0,0 +1,275 @@
+import copy
+import io
+import logging
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+# 边压缩边分片上传: zip写入一个不可seek的流，攒够一个分片就交给上传线程
+
+# S3要求除最后一片外每片至少5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3MultipartUploader:
+    # 使用boto3风格的client做分片上传，client由调用方创建(可以指向本地的S3兼容服务)
+    def __init__(self, client, bucket, key, content_type='application/zip'):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.upload_id = None
+
+    def start(self):
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                       ContentType=self.content_type)
+        self.upload_id = response['UploadId']
+
+    def upload_part(self, part_number, data):
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=data)
+        return response['ETag']
+
+    def complete(self, parts):
+        response = self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': [{'ETag': etag, 'PartNumber': number} for number, etag in parts]})
+        return response.get('Location') or "s3://%s/%s" % (self.bucket, self.key)
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class LocalMultipartUploader:
+    # 本地替身: 分片写到目录里，complete时按顺序拼接，用于测试和基准
+    def __init__(self, folder, name):
+        self.folder = folder
+        self.name = name
+        self.parts_path = os.path.join(folder, name + ".parts")
+
+    def start(self):
+        os.makedirs(self.parts_path, exist_ok=True)
+
+    def upload_part(self, part_number, data):
+        with open(os.path.join(self.parts_path, "%05d" % part_number), 'wb') as f:
+            f.write(data)
+        return str(part_number)
+
+    def complete(self, parts):
+        path = os.path.join(self.folder, self.name)
+        with open(path, 'wb') as out:
+            for number, _ in parts:
+                with open(os.path.join(self.parts_path, "%05d" % number), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        shutil.rmtree(self.parts_path)
+        return path
+
+    def abort(self):
+        shutil.rmtree(self.parts_path, ignore_errors=True)
+
+
+class MultipartUploadStream:
+    # 给zipfile用的只写流，内存占用不超过 (max_pending_parts + workers + 1) * part_size
+    def __init__(self, uploader, part_size=DEFAULT_PART_SIZE, workers=2, max_pending_parts=2):
+        self.uploader = uploader
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.bytes_written = 0
+        self.parts = []
+        self._buffer = bytearray()
+        self._part_number = 0
+        self._queue = queue.Queue(maxsize=max_pending_parts)
+        self._error = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.uploader.start()
+        self._workers = [threading.Thread(target=self._upload_worker, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _upload_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            part_number, data = item
+            try:
+                if self._error is None:
+                    etag = self.uploader.upload_part(part_number, bytes(data))
+                    with self._lock:
+                        self.parts.append((part_number, etag))
+            except BaseException as e:
+                self._error = e
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _send_part(self, data):
+        self._check_error()
+        self._part_number += 1
+        self._queue.put((self._part_number, data))
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("流已关闭")
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._send_part(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        self._check_error()
+
+    def _stop_workers(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def close(self):
+        # 上传最后一片并合并，返回上传后的地址
+        if self._closed:
+            return None
+        self._closed = True
+        try:
+            if self._buffer or self._part_number == 0:
+                self._send_part(self._buffer)
+                self._buffer = bytearray()
+            self._stop_workers()
+            self._check_error()
+            return self.uploader.complete(sorted(self.parts))
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self._closed = True
+        if any(worker.is_alive() for worker in self._workers):
+            self._error = self._error or RuntimeError("上传已取消")
+            self._stop_workers()
+        try:
+            self.uploader.abort()
+        except Exception:
+            logging.exception("取消分片上传失败")
+
+
+# 已经压缩过的媒体格式，再deflate只会浪费CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.mp3', '.m4a', '.aac', '.mp4', '.mov'}
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+def zip_compression(name, level=DEFAULT_COMPRESS_LEVEL):
+    # 返回 (compress_type, compresslevel): json等模板文件deflate，媒体文件直接存储
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, level
+
+
+class ZipStats:
+    def __init__(self):
+        self.entries = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.stored_bytes = 0
+        self.deflate_seconds = 0.0
+
+    def add(self, info, seconds):
+        self.entries += 1
+        self.raw_bytes += info.file_size
+        self.compressed_bytes += info.compress_size
+        if info.compress_type == zipfile.ZIP_STORED:
+            self.stored_bytes += info.file_size
+        else:
+            self.deflate_seconds += seconds
+
+    def as_dict(self):
+        return {"entries": self.entries, "raw_bytes": self.raw_bytes, "compressed_bytes": self.compressed_bytes,
+                "stored_bytes": self.stored_bytes, "deflate_seconds": round(self.deflate_seconds, 6)}
+
+
+def write_zip_entry(zfile, file_path, arcname, stats, level=DEFAULT_COMPRESS_LEVEL):
+    compress_type, compresslevel = zip_compression(arcname, level)
+    start = time.perf_counter()
+    zfile.write(file_path, arcname, compress_type=compress_type, compresslevel=compresslevel)
+    stats.add(zfile.infolist()[-1], time.perf_counter() - start)
+
+
+def _zip_info(arcname, level, date_time=None, mode=0o644):
+    compress_type, compresslevel = zip_compression(arcname, level)
+    zinfo = zipfile.ZipInfo(arcname, date_time or time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type
+    zinfo._compresslevel = compresslevel
+    zinfo.external_attr = (0o100000 | mode) << 16
+    return zinfo
+
+
+def write_zip_data(zfile, data, arcname, stats, level=DEFAULT_COMPRESS_LEVEL, date_time=None, mode=0o644):
+    # 内存中的数据直接写入zip，不经过临时文件
+    zinfo = _zip_info(arcname, level, date_time, mode)
+    start = time.perf_counter()
+    zfile.writestr(zinfo, data)
+    stats.add(zinfo, time.perf_counter() - start)
+    return zinfo
+
+
+@contextmanager
+def zip_text_entry(zfile, arcname, stats, level=DEFAULT_COMPRESS_LEVEL):
+    # 返回写入zip条目的文本流，生成的json边编码边压缩，不落盘
+    zinfo = _zip_info(arcname, level)
+    start = time.perf_counter()
+    with zfile.open(zinfo, 'w') as raw:
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as fp:
+            yield fp
+    stats.add(zinfo, time.perf_counter() - start)
+
+
+def copy_zip_entry(source, info, zfile, arcname, stats=None, chunk_size=1024 * 1024):
+    # 不解压，直接把source中info对应的压缩数据复制到zfile，用于增量生成时复用上一版草稿的素材
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile("本地文件头损坏: %s" % info.filename)
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    source.fp.seek(fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    zinfo = copy.copy(info)
+    zinfo.filename = arcname
+    zinfo.extra = b""
+    # CRC和大小都已知，不需要数据描述符
+    zinfo.flag_bits &= ~0x08
+    start = time.perf_counter()
+    with zfile._lock:
+        if zfile._seekable:
+            zfile.fp.seek(zfile.start_dir)
+        zinfo.header_offset = zfile.fp.tell()
+        zfile._writecheck(zinfo)
+        zfile._didModify = True
+        zfile.fp.write(zinfo.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source.fp.read(min(chunk_size, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile("压缩数据不完整: %s" % info.filename)
+            zfile.fp.write(chunk)
+            remaining -= len(chunk)
+        zfile.filelist.append(zinfo)
+        zfile.NameToInfo[zinfo.filename] = zinfo
+        zfile.start_dir = zfile.fp.tell()
+    if stats is not None:
+        stats.add(zinfo, time.perf_counter() - start)
+    return zinfo
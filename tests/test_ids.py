@@ -0,0 +1,56 @@
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from script_to_draft_v2_ids import UuidAllocator, get_default_allocator, id_allocator
+
+# 在仓库目录下用 python -m pytest 运行
+
+# fork前在父进程里建好、子进程直接继承的分配器
+_standalone = None
+
+
+def _fork_sample(_):
+    # 子进程里直接用fork时继承下来的分配器
+    return get_default_allocator().take(4) + _standalone.take(4)
+
+
+@pytest.mark.parametrize("seed", [None, 1])
+def test_format_and_version_bits(seed):
+    # 格式和版本位与uuid模块一致
+    for value in UuidAllocator(seed=seed).take(10000):
+        parsed = uuid.UUID(value)
+        assert str(parsed).upper() == value
+        assert parsed.version == 4 and parsed.variant == uuid.RFC_4122
+
+
+def test_new_and_take_share_the_buffer():
+    allocator = UuidAllocator(seed=3, batch=16)
+    values = [allocator.new() for _ in range(10)] + allocator.take(30)
+    assert values == UuidAllocator(seed=3, batch=16).take(40)
+    assert len(set(values)) == 40
+
+
+def test_seed_is_reproducible():
+    assert UuidAllocator(seed=1).take(5000) == UuidAllocator(seed=1).take(5000)
+    assert UuidAllocator(seed=1).take(5000) != UuidAllocator(seed=2).take(5000)
+    assert id_allocator(1).take(10) == UuidAllocator(seed=1).take(10)
+    assert id_allocator() is get_default_allocator()
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要fork")
+def test_forked_children_do_not_reuse_parent_ids():
+    # 父进程的两个分配器缓冲区里都还有没用完的id，fork出的进程必须各自生成新的id
+    global _standalone
+    get_default_allocator().new()
+    _standalone = UuidAllocator()
+    _standalone.new()
+    try:
+        with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("fork")) as executor:
+            children = list(executor.map(_fork_sample, range(4)))
+        parent = get_default_allocator().take(4) + _standalone.take(4)
+    finally:
+        _standalone = None
+    assert len({value for sample in children for value in sample} | set(parent)) == 8 * 5
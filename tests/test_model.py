@@ -0,0 +1,40 @@
+import json
+import pickle
+
+import pytest
+
+# 在仓库目录下用 python -m pytest 运行
+# CutDraft按部署时的包名 modules 导入，依赖(moviepy、PIL等)不全时跳过
+
+CutDraft = pytest.importorskip("modules.script_to_draft_v2").CutDraft
+from modules.script_to_draft_v2_model import TextMaterial, TextSegment, VideoSegment  # noqa: E402
+from modules.script_to_draft_v2_template import compile_material_templates  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def draft():
+    return CutDraft("test", "test", "/tmp/test", [], 0)
+
+
+def build_pairs(draft, segments=100):
+    # (creator生成的dict, 对应的模型对象)
+    pairs = []
+    for i in range(segments):
+        refs = ["C%d" % i, "S%d" % i, "A%d" % i]
+        pairs.append((draft.video_segement_creator(refs, 1000 + i, i * 1000, "V%d" % i, "VS%d" % i),
+                      VideoSegment(refs, 1000 + i, i * 1000, "V%d" % i, "VS%d" % i)))
+        pairs.append((draft.text_segment_creator(refs, 1000 + i, i * 1000, "T%d" % i, "TS%d" % i),
+                      TextSegment(refs, 1000 + i, i * 1000, "T%d" % i, "TS%d" % i)))
+        pairs.append((draft.text_creator("第%d句字幕" % i, "T%d" % i), TextMaterial("第%d句字幕" % i, "T%d" % i)))
+    return pairs
+
+
+def test_render_matches_creator_json(draft):
+    templates = compile_material_templates(draft)
+    for item, model in build_pairs(draft):
+        assert model.render(templates) == json.dumps(item, ensure_ascii=False)
+
+
+def test_models_pickle_round_trip(draft):
+    models = [model for _, model in build_pairs(draft, 10)]
+    assert pickle.loads(pickle.dumps(models)) == models
@@ -0,0 +1,124 @@
+import struct
+
+import pytest
+
+from script_to_draft_v2_placeholder import make_mp3, make_png
+from script_to_draft_v2_probe import _ffmpeg_seconds, probe_image_size, probe_mp3_duration
+
+# 在仓库目录下用 python -m pytest 运行
+
+SAMPLE_RATE = 44100
+SAMPLES_PER_FRAME = 1152
+BITRATE = 128
+
+
+def id3v2_tag(payload_size):
+    # ID3v2.3标签头，长度字段是7位一组的syncsafe整数
+    size = bytes([(payload_size >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+    return b"ID3\x03\x00\x00" + size + b"\0" * payload_size
+
+
+def split_frames(data):
+    # 按帧头把make_mp3生成的CBR数据切成帧
+    frames = []
+    pos = 0
+    while pos < len(data):
+        padding = (data[pos + 2] >> 1) & 1
+        size = 144 * BITRATE * 1000 // SAMPLE_RATE + padding
+        frames.append(data[pos:pos + size])
+        pos += size
+    return frames
+
+
+@pytest.fixture
+def cbr_info(tmp_path):
+    path = tmp_path / "info.mp3"
+    make_mp3(str(path), 2.0)
+    return path
+
+
+def test_cbr_with_info_tag(cbr_info):
+    # Info标签记录了76帧，不计标签帧本身
+    frames = int(2.0 * SAMPLE_RATE / SAMPLES_PER_FRAME)
+    assert frames == 76
+    assert probe_mp3_duration(str(cbr_info)) == 1.99
+    assert probe_mp3_duration(str(cbr_info)) == _ffmpeg_seconds(frames * SAMPLES_PER_FRAME / SAMPLE_RATE)
+
+
+def test_cbr_without_tag(cbr_info, tmp_path):
+    # 去掉带Info标签的第一帧，ffmpeg按文件大小和码率估算
+    data = b"".join(split_frames(cbr_info.read_bytes())[1:])
+    path = tmp_path / "plain.mp3"
+    path.write_bytes(data)
+    assert len(split_frames(data)) == 76 and len(data) == 31764
+    assert probe_mp3_duration(str(path)) == _ffmpeg_seconds(len(data) * 8 / (BITRATE * 1000)) == 1.99
+
+
+def test_id3v2_prefixed(cbr_info, tmp_path):
+    tagged = tmp_path / "tagged.mp3"
+    tagged.write_bytes(id3v2_tag(300) + cbr_info.read_bytes())
+    assert probe_mp3_duration(str(tagged)) == probe_mp3_duration(str(cbr_info))
+
+    # 没有Info标签时，ID3v2标签的长度不计入码率估算
+    data = b"".join(split_frames(cbr_info.read_bytes())[1:])
+    plain = tmp_path / "plain_tagged.mp3"
+    plain.write_bytes(id3v2_tag(5000) + data)
+    assert probe_mp3_duration(str(plain)) == _ffmpeg_seconds(len(data) * 8 / (BITRATE * 1000))
+
+
+def test_vbr_without_tag_falls_back(cbr_info, tmp_path):
+    # 混合两种码率且没有Xing/Info标签: ffmpeg的估算方式不同，返回None交给MoviePy
+    frames = split_frames(cbr_info.read_bytes())[1:]
+    # 160kbps的帧，bitrate_index = 10
+    frame_160 = bytes([0xFF, 0xFB, 10 << 4, 0x44]) + b"\0" * (144 * 160 * 1000 // SAMPLE_RATE - 4)
+    path = tmp_path / "vbr.mp3"
+    path.write_bytes(b"".join(frames[:20]) + frame_160 * 20 + b"".join(frames[20:]))
+    assert probe_mp3_duration(str(path)) is None
+
+
+def test_not_mp3(tmp_path):
+    path = tmp_path / "noise.mp3"
+    path.write_bytes(b"not an mp3 file" * 100)
+    assert probe_mp3_duration(str(path)) is None
+    assert probe_mp3_duration(str(tmp_path / "missing.mp3")) is None
+
+
+def test_png(tmp_path):
+    path = tmp_path / "a.png"
+    make_png(str(path), 37, 21)
+    assert probe_image_size(str(path)) == (37, 21)
+
+
+def test_jpeg(tmp_path):
+    # SOI、APP0、DHT(C4不是SOF)、SOF0(高, 宽)、EOI
+    app0 = b"\xFF\xE0" + struct.pack(">H", 16) + b"JFIF\0\x01\x01\0\0\x01\0\x01\0\0"
+    dht = b"\xFF\xC4" + struct.pack(">H", 5) + b"\0\0\0"
+    sof0 = b"\xFF\xC0" + struct.pack(">HBHHB", 11, 8, 600, 800, 1) + b"\x01\x11\x00"
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"\xFF\xD8" + app0 + dht + sof0 + b"\xFF\xD9")
+    assert probe_image_size(str(path)) == (800, 600)
+
+
+def webp(chunk, payload):
+    body = b"WEBP" + chunk + struct.pack("<I", len(payload)) + payload
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+@pytest.mark.parametrize("data", [
+    # 有损: 帧标记 + 起始码 + 14位宽高
+    webp(b"VP8 ", b"\0\0\0\x9d\x01\x2a" + struct.pack("<HH", 1280, 720) + b"\0" * 8),
+    # 无损: 签名0x2F + 宽-1、高-1各14位
+    webp(b"VP8L", b"\x2F" + struct.pack("<I", (1280 - 1) | (720 - 1) << 14) + b"\0" * 8),
+    # 扩展格式: 4字节标志 + 24位的宽-1、高-1
+    webp(b"VP8X", b"\0" * 4 + (1280 - 1).to_bytes(3, "little") + (720 - 1).to_bytes(3, "little")),
+])
+def test_webp(tmp_path, data):
+    path = tmp_path / "a.webp"
+    path.write_bytes(data)
+    assert probe_image_size(str(path)) == (1280, 720)
+
+
+def test_unknown_image(tmp_path):
+    path = tmp_path / "a.gif"
+    path.write_bytes(b"GIF89a" + b"\0" * 32)
+    assert probe_image_size(str(path)) is None
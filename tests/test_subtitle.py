@@ -0,0 +1,90 @@
+import re
+
+import pytest
+
+from script_to_draft_v2_subtitle import caption_timings, make_script, split_captions, split_sentences, \
+    subtitle_timings
+
+# 在仓库目录下用 python -m pytest 运行
+
+
+def _legacy_timings(content, start_time, duration):
+    # 原来的实现: 未编译的re.split + 浮点累加，用来对照新实现的切分结果
+    sentences = re.split('。|,|，|！|\\!|\\.|？|\\?|“|：|”', content)
+    while '' in sentences: sentences.remove('')
+    timings = []
+    text_start_time = start_time
+    for sentence in sentences:
+        text_duration = duration * len(sentence) / len(''.join(sentences))
+        timings.append((text_start_time, text_duration))
+        text_start_time += text_duration
+    return sentences, timings
+
+
+@pytest.fixture(scope="module")
+def script():
+    contents, durations = make_script()
+    captions = split_captions(contents)
+    return contents, durations, captions, caption_timings(captions, durations)
+
+
+def test_script_size(script):
+    contents = script[0]
+    assert sum(map(len, contents)) >= 100000
+
+
+def test_split_matches_legacy(script):
+    contents, _, captions, _ = script
+    for content, sentences in zip(contents, captions):
+        assert sentences == _legacy_timings(content, 0, 1000000)[0]
+        assert sentences == split_sentences(content)
+
+
+def test_timings_are_integers(script):
+    timings = script[3]
+    assert all(isinstance(value, int) for timing in timings for item in timing for value in item)
+
+
+def test_durations_sum_to_caption_duration(script):
+    _, durations, captions, timings = script
+    for sentences, timing, duration in zip(captions, timings, durations):
+        if sentences:
+            assert sum(length for _, length in timing) == duration
+        else:
+            assert timing == []
+
+
+def test_boundaries_are_contiguous(script):
+    # 每条字幕的第一个小字幕从字幕开头开始，最后一个正好结束在音频片段末尾，中间首尾相接
+    _, durations, _, timings = script
+    start_time = 0
+    for timing, duration in zip(timings, durations):
+        if timing:
+            assert timing[0][0] == start_time
+            assert timing[-1][0] + timing[-1][1] == start_time + duration
+            for (begin, length), (next_begin, _) in zip(timing, timing[1:]):
+                assert begin + length == next_begin
+            assert all(length >= 0 for _, length in timing)
+        start_time += duration
+
+
+def test_boundaries_match_legacy(script):
+    # 与原来的浮点累加相比，每个边界相差不到1微秒
+    contents, durations, _, timings = script
+    start_time = 0
+    for content, timing, duration in zip(contents, timings, durations):
+        legacy_timing = _legacy_timings(content, start_time, duration)[1]
+        assert len(legacy_timing) == len(timing)
+        for (legacy_start, legacy_duration), (begin, length) in zip(legacy_timing, timing):
+            assert abs(legacy_start - begin) < 1
+            assert abs(legacy_start + legacy_duration - begin - length) < 1
+        start_time += duration
+
+
+def test_subtitle_timings_edge_cases():
+    assert subtitle_timings([], 100, 1000) == []
+    assert subtitle_timings(["", ""], 100, 1000) == []
+    assert subtitle_timings(["一二三"], 100, 1000) == [(100, 1000)]
+    # 除不尽时向下取整，余数留给后面的边界，总时长不变
+    assert subtitle_timings(["一", "二", "三"], 0, 10) == [(0, 3), (3, 3), (6, 4)]
+    assert subtitle_timings(["一", "二"], 5, 0) == [(5, 0), (5, 0)]
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+# 在仓库目录下用 python -m pytest 运行
+# CutDraft按部署时的包名 modules 导入，依赖(moviepy、PIL等)不全时跳过
+
+CutDraft = pytest.importorskip("modules.script_to_draft_v2").CutDraft
+from modules.script_to_draft_v2_json import encoder  # noqa: E402
+from modules.script_to_draft_v2_template import compile_material_templates  # noqa: E402
+
+REFS = ["A", "B", "C"]
+
+
+@pytest.fixture(scope="module")
+def draft():
+    return CutDraft("test", "test", "/tmp/test", [], 0)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_segment_templates_match_creators(draft, compact):
+    templates = compile_material_templates(draft, compact)
+    encode = encoder(compact)
+    for i in range(100):
+        assert templates['video_segment'].render(material_uuid_list=REFS, duration=1000 + i, start_time=i * 1000,
+                                                 video_uuid="V%d" % i, video_segment_uuid="S%d" % i) == \
+            encode(draft.video_segement_creator(REFS, 1000 + i, i * 1000, "V%d" % i, "S%d" % i))
+        assert templates['text_segment'].render(material_uuid_list=REFS, duration=1000 + i, start_time=i * 1000,
+                                                text_uuid="T%d" % i, text_segment_uuid="S%d" % i) == \
+            encode(draft.text_segment_creator(REFS, 1000 + i, i * 1000, "T%d" % i, "S%d" % i))
+        assert templates['audio_segment'].render(material_uuid_list=REFS, duration=1000 + i, start_time=i * 1000,
+                                                 audio_uuid="A%d" % i, audio_segment_uuid="S%d" % i) == \
+            encode(draft.audio_segment_creator(REFS, 1000 + i, i * 1000, "A%d" % i, "S%d" % i))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_material_templates_match_creators(draft, compact):
+    templates = compile_material_templates(draft, compact)
+    encode = encoder(compact)
+    for content in ("字幕", "带\"引号\"的字幕", ""):
+        assert templates['text'].render(content=draft.text_content(content), text_uuid="T") == \
+            encode(draft.text_creator(content, "T"))
+    assert templates['speed'].render(speed_uuid="S") == encode(draft.speeds_creator("S"))
+    assert templates['canvas'].render(uuid="C") == encode(draft.canvases_creator("C"))
+    assert templates['animation'].render(uuid="A") == encode(draft.animation_creator("A"))
+    assert templates['sound_channel_mapping'].render(audio_channel_mapping_uuid="M") == \
+        encode(draft.sound_channel_mappings_creator("M"))
+
+
+def test_default_templates_match_json_dumps(draft):
+    templates = compile_material_templates(draft)
+    assert templates['video_segment'].render(material_uuid_list=REFS, duration=1000, start_time=0, video_uuid="V",
+                                             video_segment_uuid="S") == \
+        json.dumps(draft.video_segement_creator(REFS, 1000, 0, "V", "S"), ensure_ascii=False)